@@ -0,0 +1,274 @@
+"""
+Compares the string-literal decoder against the eval()-based text extraction it replaced.
+
+    python benchmark.py --files 500 --annotations 10
+
+With --suite, times the hot paths and the CLI on a synthetic spec and SDK repository instead, and
+records the results as json so they can be compared between commits:
+
+    python benchmark.py --suite --output before.json
+    python benchmark.py --suite --compare before.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+from collections.abc import Callable
+from typing import Any
+
+from spec_finder import (
+    Config,
+    Specification,
+    _demarkdown,
+    decode_string_literal,
+    find_covered_specs,
+    gen_report,
+    iter_source_files,
+    merge_coverage,
+    scan_files,
+)
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spec_finder.py')
+
+JAVA_CONFIG: Config = {
+    'file_extension': 'java',
+    'multiline_regex': r'@Specification\((?P<innards>.*?)\)\s*$',
+    'number_subregex': r'number\s*=\s*[\'"](.*?)[\'"]',
+    'text_subregex': r'text\s*=\s*[\'"](.*)[\'"]',
+    'inline_comment_prefix': None,
+}
+
+
+def legacy_find_covered_specs(config: Config, data: str) -> dict[str, str]:
+    """find_covered_specs() as it was before decode_string_literal() existed."""
+    repo_specs = {}
+    for match in re.findall(config['multiline_regex'], data, re.MULTILINE | re.DOTALL):
+        match = match.replace('\n', '')
+        match = re.sub(' {2,}', ' ', match.strip())
+        number = re.findall(config['number_subregex'], match)[0]
+
+        text_with_concat_chars = re.findall(config['text_subregex'], match, re.MULTILINE | re.DOTALL)
+        try:
+            text = ''.join(text_with_concat_chars).strip()
+            text = _demarkdown(eval('"%s"' % text))
+            repo_specs[number] = text
+        except Exception:
+            print(f"Skipping {match} b/c we couldn't parse it")
+    return repo_specs
+
+
+def synthetic_test_file(file_number: int, annotations: int) -> str:
+    """Builds a Java test class with the given number of annotated test methods."""
+    out = [f'class Spec{file_number}Test {{\n']
+    for i in range(annotations):
+        number = f'{file_number}.{i}.1'
+        out.append(
+            f'    @Specification(number="{number}", text="The \\"client\\" MUST do thing {i}, " +\n'
+            f'        "which is long enough to be split across lines.")\n'
+            f'    @Test\n'
+            f'    void test{i}() {{}}\n\n'
+        )
+    out.append('}\n')
+    return ''.join(out)
+
+
+def _rule(number: str, kind: str = 'Requirement', children: list[dict[str, Any]] | None = None) -> dict[str, Any]:
+    rule_id = f'{kind} {number}'
+    return {
+        'id': rule_id,
+        'machine_id': re.sub(r'\W', '_', rule_id.lower()),
+        'content': f'The client MUST do what {rule_id} says, which is long enough to matter.',
+        'RFC 2119 keyword': 'MUST',
+        'children': children or [],
+    }
+
+
+def synthetic_specification(requirements: int, depth: int = 2) -> dict[str, Any]:
+    """
+    Builds specification.json data with the given number of top-level rules, 50 per section.
+
+    With a depth, every tenth rule is a condition with that many levels of nested conditions below it,
+    each holding a conditional requirement.
+    """
+    rules = []
+    for i in range(requirements):
+        section, number = divmod(i, 50)
+        prefix = f'{section + 1}.{number + 1}'
+        if not depth or number % 10 != 9:
+            rules.append(_rule(prefix))
+            continue
+        children: list[dict[str, Any]] = []
+        for level in reversed(range(depth)):
+            nested = prefix + '.2' * level
+            children = [_rule(nested, 'Condition', [_rule(f'{nested}.1', 'Conditional Requirement'), *children])]
+        rules.extend(children)
+    return {'rules': rules}
+
+
+def synthetic_repository(root: str, spec: Specification, files: int, density: int) -> None:
+    """
+    Writes an SDK repository covering `spec` with `files` Java test files into `root`.
+
+    Files hold 0, 1, 2 or 4 times `density` annotations in turn, and every 20th annotation has stale text.
+    """
+    numbers = sorted(spec.spec_map)
+    os.makedirs(os.path.join(root, 'src', 'test'))
+    with open(os.path.join(root, '.specrc'), 'w') as f:
+        f.write('[spec]\n' + ''.join(f'{key}={value}\n' for key, value in JAVA_CONFIG.items() if value is not None))
+    with open(os.path.join(root, 'specification.json'), 'w') as f:
+        json.dump(spec.data, f)
+
+    written = 0
+    for file_number in range(files):
+        out = [f'class Spec{file_number}Test {{\n']
+        for _ in range(density * (0, 1, 2, 4)[file_number % 4]):
+            number = numbers[written % len(numbers)]
+            text = spec.spec_map[number] if written % 20 else 'Stale text.'
+            written += 1
+            out.append(
+                f'    @Specification(number="{number}", text="{text[:30]}" +\n'
+                f'        "{text[30:]}")\n'
+                f'    @Test\n'
+                f'    void test{written}() {{}}\n\n'
+            )
+        out.append('}\n')
+        with open(os.path.join(root, 'src', 'test', f'Spec{file_number}Test.java'), 'w') as f:
+            f.write(''.join(out))
+
+
+def git_commit() -> str | None:
+    """The commit the benchmark runs on, or None outside of a git checkout."""
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(SCRIPT), capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def measure(cases: dict[str, Callable[[], object]], repeat: int) -> dict[str, dict[str, Any]]:
+    """Runs every case `repeat` times and returns the runs in milliseconds by case name."""
+    results = {}
+    for name, case in cases.items():
+        runs = [run * 1000 for run in timeit.repeat(case, number=1, repeat=repeat)]
+        results[name] = {'best_ms': round(min(runs), 3), 'runs_ms': [round(run, 3) for run in runs]}
+    return results
+
+
+def report(results: dict[str, dict[str, Any]], baseline: dict[str, dict[str, Any]] | None = None) -> None:
+    """Prints the best run of every case, and how it changed since the `baseline` results."""
+    for name, result in results.items():
+        line = f'{name:>18}: {result["best_ms"]:.1f} ms'
+        before = (baseline or {}).get(name)
+        if before and before['best_ms']:
+            line += f' ({(result["best_ms"] / before["best_ms"] - 1) * 100:+.0f}%)'
+        print(line)
+
+
+def suite(requirements: int, depth: int, files: int, density: int, repeat: int) -> dict[str, dict[str, Any]]:
+    """Times annotation extraction, reporting, scanning and the CLI on a synthetic spec and repository."""
+    spec = Specification(synthetic_specification(requirements, depth))
+    with tempfile.TemporaryDirectory() as repo:
+        synthetic_repository(repo, spec, files, density)
+        paths = list(iter_source_files(repo, JAVA_CONFIG['file_extension']))
+        sources = []
+        for path in paths:
+            with open(path) as f:
+                sources.append(f.read())
+        repo_specs = merge_coverage(scan_files(JAVA_CONFIG, paths))
+        print(
+            f'{len(spec.spec_map)} requirements, {files} files with {sum(map(len, sources)) / 1024 / 1024:.1f} MiB '
+            f'and {len(repo_specs)} distinct annotations'
+        )
+
+        def cli(*args: str) -> None:
+            subprocess.run(
+                [sys.executable, SCRIPT, '--code-directory', repo, *args],
+                cwd=repo,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+
+        cli('--cache-file', 'cache.json')
+        cases: dict[str, Callable[[], object]] = {
+            'find_covered_specs': lambda: [find_covered_specs(JAVA_CONFIG, source) for source in sources],
+            'gen_report': lambda: gen_report(spec.spec_map, repo_specs),
+            'scan_files': lambda: scan_files(JAVA_CONFIG, paths),
+            'cli': lambda: cli(),
+            'cli cached': lambda: cli('--cache-file', 'cache.json'),
+        }
+        return measure(cases, repeat)
+
+
+def main(files: int, annotations: int, repeat: int) -> None:
+    sources = [synthetic_test_file(i, annotations) for i in range(files)]
+    print(f'{files} files with {files * annotations} annotations')
+
+    for source in sources:
+        assert legacy_find_covered_specs(JAVA_CONFIG, source) == find_covered_specs(JAVA_CONFIG, source)
+
+    texts = [
+        ''.join(re.findall(JAVA_CONFIG['text_subregex'], match.replace('\n', ''), re.DOTALL)).strip()
+        for source in sources
+        for match in re.findall(JAVA_CONFIG['multiline_regex'], source, re.MULTILINE | re.DOTALL)
+    ]
+
+    cases = {
+        'eval': lambda: [legacy_find_covered_specs(JAVA_CONFIG, source) for source in sources],
+        'decoder': lambda: [find_covered_specs(JAVA_CONFIG, source) for source in sources],
+        'eval only': lambda: [eval('"%s"' % text) for text in texts],
+        'decode only': lambda: [decode_string_literal(text) for text in texts],
+    }
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(f'{name:>12}: {best * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark annotation text extraction')
+    parser.add_argument('--files', type=int, default=200, help='number of test files to generate')
+    parser.add_argument('--annotations', type=int, default=20, help='annotations per file')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best one is reported')
+    parser.add_argument('--suite', action='store_true', help='time the hot paths and the CLI instead')
+    parser.add_argument('--requirements', type=int, default=2000, help='with --suite, top-level rules in the spec')
+    parser.add_argument('--depth', type=int, default=2, help='with --suite, levels of nested conditions')
+    parser.add_argument('--output', help='with --suite, store the results as json in this file')
+    parser.add_argument('--compare', help='with --suite, compare against the results stored in this file')
+    args = parser.parse_args()
+    if not args.suite:
+        main(args.files, args.annotations, args.repeat)
+        sys.exit()
+
+    parameters = {key: getattr(args, key) for key in ('requirements', 'depth', 'files', 'annotations', 'repeat')}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous['parameters'] != parameters:
+            print(f'{args.compare} was recorded with other parameters: {previous["parameters"]}', file=sys.stderr)
+        baseline = previous['results']
+
+    results = suite(args.requirements, args.depth, args.files, args.annotations, args.repeat)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {
+                    'tool': 'spec_finder',
+                    'commit': git_commit(),
+                    'python': platform.python_version(),
+                    'parameters': parameters,
+                    'results': results,
+                },
+                f,
+                indent=4,
+            )
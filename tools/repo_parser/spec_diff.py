@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""
+Compares versions of specification.json and reports which rules were added, removed, renumbered or reworded.
+
+    python spec_diff.py old/specification.json new/specification.json
+    python spec_diff.py --json changelog.json v0.5.0/ v0.6.0/ v0.7.0/ https://.../specification.json
+
+Each version is compared to the one before it, so a whole release history can be diffed in one run.
+"""
+
+from __future__ import annotations
+
+import difflib
+import json
+import re
+import sys
+from collections import Counter
+from typing import TypedDict
+
+from spec_finder import (
+    Rule,
+    SpecFetchError,
+    Specification,
+    _demarkdown,
+    diff_texts,
+    fetch_spec,
+    load_specification,
+    normalize_text,
+)
+
+# Rules that changed both their number and their text are matched up when their words are at least this similar.
+DEFAULT_SIMILARITY = 0.6
+
+
+class RuleChange(TypedDict):
+    change: str
+    old_id: str | None
+    new_id: str | None
+    old_keyword: str | None
+    new_keyword: str | None
+    similarity: float | None
+    diff: str | None
+
+
+class Changelog(TypedDict):
+    old: str
+    new: str
+    summary: dict[str, int]
+    changes: list[RuleChange]
+
+
+def _text(rule: Rule) -> str:
+    # normalized first, so curly quotes become straight ones that _demarkdown() drops
+    return _demarkdown(normalize_text(rule['content']))
+
+
+def _change(change: str, old: Rule | None, new: Rule | None) -> RuleChange:
+    rule_change: RuleChange = {
+        'change': change,
+        'old_id': old['id'] if old else None,
+        'new_id': new['id'] if new else None,
+        'old_keyword': old['RFC 2119 keyword'] if old else None,
+        'new_keyword': new['RFC 2119 keyword'] if new else None,
+        'similarity': None,
+        'diff': None,
+    }
+    if old and new and _text(old) != _text(new):
+        text_diff = diff_texts(_text(old), _text(new))
+        rule_change['similarity'] = text_diff['similarity']
+        rule_change['diff'] = text_diff['diff']
+    return rule_change
+
+
+def _change_order(change: RuleChange) -> list[int]:
+    number = re.search(r'\d+(\.\d+)*', change['new_id'] or change['old_id'] or '')
+    return [int(part) for part in number.group().split('.')] if number else []
+
+
+def diff_specifications(
+    old: Specification,
+    new: Specification,
+    similarity: float = DEFAULT_SIMILARITY,
+    old_name: str = 'old',
+    new_name: str = 'new',
+) -> Changelog:
+    """
+    Returns the changes from the `old` to the `new` specification, rules at any depth included.
+
+    Rules are matched up in rounds, each only looking at what the previous ones left over: the same
+    machine id and text is an unchanged rule; the same text is a renumbered rule; the same machine
+    id is a reworded rule; and the most similar pairs of at least `similarity` are renumbered rules
+    with a changed text. Whatever is left was removed or added. Texts are compared without markdown
+    and with the default normalizers, so changes to quotes or whitespace alone don't count.
+    """
+
+    def unchanged(rule: Rule, other: Specification) -> bool:
+        counterpart = other.by_machine_id.get(rule['machine_id'])
+        return counterpart is not None and _text(counterpart) == _text(rule)
+
+    removed = [rule for rule in old.rules if not unchanged(rule, new)]
+    added = [rule for rule in new.rules if not unchanged(rule, old)]
+    changes: list[RuleChange] = []
+
+    # checked before machine ids, so a rule moving into the number of a removed one isn't taken for a rewording
+    by_text: dict[str, list[Rule]] = {}
+    for rule in removed:
+        by_text.setdefault(_text(rule), []).append(rule)
+    rest = []
+    for rule in added:
+        if same_text := by_text.get(_text(rule)):
+            changes.append(_change('renumbered', same_text.pop(0), rule))
+        else:
+            rest.append(rule)
+    by_machine_id: dict[str, list[Rule]] = {}
+    for rules in by_text.values():
+        for rule in rules:
+            by_machine_id.setdefault(rule['machine_id'], []).append(rule)
+
+    unmatched = []
+    for rule in rest:
+        if same_machine_id := by_machine_id.get(rule['machine_id']):
+            changes.append(_change('reworded', same_machine_id.pop(0), rule))
+        else:
+            unmatched.append(rule)
+    removed = [rule for rules in by_machine_id.values() for rule in rules]
+
+    # SequenceMatcher caches what it learned about seq2, so each new text is compared to every old one in turn
+    old_words = [_text(rule).split() for rule in removed]
+    candidates = []
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    for j, rule in enumerate(unmatched):
+        matcher.set_seq2(_text(rule).split())
+        for i, words in enumerate(old_words):
+            matcher.set_seq1(words)
+            if matcher.real_quick_ratio() >= similarity and matcher.quick_ratio() >= similarity:
+                if (ratio := matcher.ratio()) >= similarity:
+                    candidates.append((ratio, i, j))
+
+    matched_old, matched_new = set(), set()
+    for _, i, j in sorted(candidates, key=lambda candidate: (-candidate[0], candidate[1], candidate[2])):
+        if i not in matched_old and j not in matched_new:
+            matched_old.add(i)
+            matched_new.add(j)
+            changes.append(_change('renumbered', removed[i], unmatched[j]))
+
+    changes.extend(_change('removed', rule, None) for i, rule in enumerate(removed) if i not in matched_old)
+    changes.extend(_change('added', None, rule) for j, rule in enumerate(unmatched) if j not in matched_new)
+    changes.sort(key=_change_order)
+
+    summary = Counter(change['change'] for change in changes)
+    summary['keyword changes'] = sum(
+        1
+        for change in changes
+        if change['old_id'] and change['new_id'] and change['old_keyword'] != change['new_keyword']
+    )
+    return {
+        'old': old_name,
+        'new': new_name,
+        'summary': {kind: summary[kind] for kind in ('added', 'removed', 'renumbered', 'reworded', 'keyword changes')},
+        'changes': changes,
+    }
+
+
+def format_changelog(changelog: Changelog) -> str:
+    summary = ', '.join(f'{count} {kind}' for kind, count in changelog['summary'].items())
+    lines = [f'{changelog["old"]} -> {changelog["new"]}: {summary}']
+    for change in changelog['changes']:
+        if change['old_id'] and change['new_id'] and change['old_id'] != change['new_id']:
+            line = f'{change["old_id"]} -> {change["new_id"]}'
+        else:
+            line = change['new_id'] or change['old_id'] or ''
+        if change['old_id'] and change['new_id'] and change['old_keyword'] != change['new_keyword']:
+            line += f', {change["old_keyword"]} -> {change["new_keyword"]}'
+        if change['diff'] is not None:
+            line += f' ({change["similarity"]:.0%} similar): {change["diff"]}'
+        lines.append(f'  {change["change"]:<10} {line}')
+    return '\n'.join(lines)
+
+
+def main(sources: list[str], similarity: float = DEFAULT_SIMILARITY, json_output: str | None = None) -> None:
+    try:
+        specs = [load_specification(fetch_spec(source)) for source in sources]
+    except SpecFetchError as e:
+        sys.exit(str(e))
+
+    changelogs = [
+        diff_specifications(old, new, similarity, old_name, new_name)
+        for (old_name, old), (new_name, new) in zip(zip(sources, specs), zip(sources[1:], specs[1:]))
+    ]
+    for changelog in changelogs:
+        print(format_changelog(changelog))
+    if json_output:
+        with open(json_output, 'w') as f:
+            json.dump(changelogs, f, indent=4)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Lists the changes between versions of the spec')
+    parser.add_argument(
+        'sources',
+        nargs='+',
+        metavar='spec',
+        help='specification.json files, directories holding one or URLs, oldest first; each is diffed with the next',
+    )
+    parser.add_argument(
+        '--similarity',
+        type=float,
+        default=DEFAULT_SIMILARITY,
+        help='how similar the words of a renumbered rule with a changed text must be (default: %(default)s)',
+    )
+    parser.add_argument('--json', dest='json_output', metavar='FILE', help='store the changelogs as json in FILE')
+    args = parser.parse_args()
+    if len(args.sources) < 2:
+        parser.error('needs at least two versions of the spec to compare')
+    main(args.sources, args.similarity, args.json_output)
@@ -2,12 +2,27 @@
 from __future__ import annotations
 
 import configparser
+import contextlib
+import cProfile
+import difflib
+import functools
+import hashlib
 import json
+import mmap
 import os
 import re
+import shutil
+import subprocess
 import sys
+import threading
+import time
+import urllib.error
 import urllib.request
-from typing import Any, TypedDict, cast
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Protocol, TypedDict, TypeVar, cast
+
+T = TypeVar('T')
 
 
 class Config(TypedDict):
@@ -18,105 +33,1128 @@ class Config(TypedDict):
     inline_comment_prefix: str | None
 
 
+class TextDiff(TypedDict):
+    kind: str
+    similarity: float
+    diff: str
+
+
 Report = TypedDict(
     'Report',
     {
         'extra': list[str],
         'missing': list[str],
         'different-text': list[str],
+        'cosmetic-text': list[str],
         'good': list[str],
+        'text-diffs': dict[str, TextDiff],
+    },
+)
+
+
+Rule = TypedDict(
+    'Rule',
+    {
+        'id': str,
+        'machine_id': str,
+        'content': str,
+        'RFC 2119 keyword': str | None,
+        'children': list['Rule'],
+    },
+)
+
+
+class Annotation(TypedDict):
+    number: str
+    text: str
+    line: int
+    column: int
+
+
+class FileCoverage(TypedDict):
+    specs: dict[str, str]
+    annotations: list[Annotation]
+
+
+class CacheEntry(FileCoverage):
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+class CoverageCache(TypedDict):
+    version: int
+    key: str
+    files: dict[str, CacheEntry]
+
+
+ReportDelta = TypedDict(
+    'ReportDelta',
+    {
+        'newly-covered': list[str],
+        'newly-missing': list[str],
+        'text-regressions': list[str],
     },
 )
 
 
+class RepositoryCoverage(TypedDict):
+    code_directory: str
+    configs: list[SpecConfig]
+    repo_specs: dict[str, str]
+    report: Report
+    baseline: Report | None
+    files: int
+    index: CoverageIndex
+
+
+class CoverageLocation(TypedDict):
+    path: str
+    line: int
+    column: int
+    text: str
+    status: str
+
+
+class CoverageIndex(TypedDict):
+    code_directory: str
+    requirements: dict[str, list[CoverageLocation]]
+    missing: list[str]
+    duplicates: list[str]
+    conflicts: list[str]
+
+
+class CoverageMatrix(TypedDict):
+    sdks: list[str]
+    requirements: dict[str, dict[str, str]]
+    extra: dict[str, list[str]]
+
+
+class FileTiming(TypedDict):
+    path: str
+    seconds: float
+    bytes_read: int
+    matches: int
+
+
+# Bump whenever the layout of the coverage cache changes.
+COVERAGE_CACHE_VERSION = 2
+
+
+class InstrumentationHook(Protocol):
+    """Receives what a run spends its time on, once registered with add_hook()."""
+
+    def on_phase(self, name: str, started: float, seconds: float) -> None: ...
+
+    def on_file(self, path: str, started: float, seconds: float, bytes_read: int, matches: int) -> None: ...
+
+
+_hooks: list[InstrumentationHook] = []
+
+
+def add_hook(hook: InstrumentationHook) -> None:
+    """Registers `hook` to be called for every phase and scanned file, possibly from several threads at once."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook: InstrumentationHook) -> None:
+    _hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Reports the wall time of the block to the hooks as the phase `name`; free while none are registered."""
+    if not _hooks:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        for hook in _hooks:
+            hook.on_phase(name, started, seconds)
+
+
+def _report_file(path: str, started: float, bytes_read: int, matches: int) -> None:
+    seconds = time.perf_counter() - started
+    for hook in _hooks:
+        hook.on_file(path, started, seconds, bytes_read, matches)
+
+
+class Timings:
+    """
+    An instrumentation hook that keeps everything it is told, for --timings.
+
+    Phases that run more than once, e.g. once per repository, are summed up. to_json() also holds
+    the phases and files as Chrome trace events, which chrome://tracing and Perfetto can display.
+    """
+
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.files: list[FileTiming] = []
+        self._events: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def _event(self, name: str, category: str, started: float, seconds: float, args: dict[str, Any]) -> None:
+        self._events.append(
+            {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((started - self.origin) * 1e6, 1),
+                'dur': round(seconds * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': args,
+            }
+        )
+
+    def on_phase(self, name: str, started: float, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self._event(name, 'phase', started, seconds, {})
+
+    def on_file(self, path: str, started: float, seconds: float, bytes_read: int, matches: int) -> None:
+        with self._lock:
+            self.files.append({'path': path, 'seconds': seconds, 'bytes_read': bytes_read, 'matches': matches})
+            self._event(path, 'file', started, seconds, {'bytes_read': bytes_read, 'matches': matches})
+
+    def summary(self, slowest: int = 5) -> str:
+        lines = [f'{name:>12}: {seconds:.3f}s' for name, seconds in self.phases.items()]
+        bytes_read = sum(file['bytes_read'] for file in self.files)
+        matches = sum(file['matches'] for file in self.files)
+        lines.append(f'{len(self.files)} files, {bytes_read} bytes read, {matches} regex matches')
+        for file in sorted(self.files, key=lambda file: file['seconds'], reverse=True)[:slowest]:
+            lines.append(f'  {file["seconds"]:.4f}s {file["path"]}')
+        return '\n'.join(lines)
+
+    def to_json(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'phases': dict(self.phases),
+                'files': list(self.files),
+                'traceEvents': list(self._events),
+                'displayTimeUnit': 'ms',
+            }
+
+
+@contextlib.contextmanager
+def instrumented(timings_path: str | None = None, profile_path: str | None = None) -> Iterator[None]:
+    """
+    Instruments the block for --timings and --profile, even when it ends in sys.exit().
+
+    With a `timings_path`, a summary is printed to stderr and, unless the path is `-`, the timings are
+    stored there as json. With a `profile_path`, cProfile stats are dumped there for pstats.
+    """
+    timings = Timings() if timings_path else None
+    profiler = cProfile.Profile() if profile_path else None
+    if timings is not None:
+        add_hook(timings)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None and profile_path:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if timings is not None and timings_path:
+            remove_hook(timings)
+            print(timings.summary(), file=sys.stderr)
+            if timings_path != '-':
+                with open(timings_path, 'w') as f:
+                    json.dump(timings.to_json(), f, indent=4)
+
+
 def _demarkdown(t: str) -> str:
     return t.replace('**', '').replace('`', '').replace('"', '')
 
 
-def get_spec_parser(code_dir: str) -> Config:
-    with open(os.path.join(code_dir, '.specrc')) as f:
-        data = '\n'.join(f.readlines())
+class ConfigError(Exception):
+    pass
 
-    typical = configparser.ConfigParser(comment_prefixes=())
-    typical.read_string(data)
-    retval = typical['spec']
 
-    if 'inline_comment_prefix' in retval:
-        # If an `inline_comment_prefix` is set, then we're using the inline
-        # comment approach, which should obviate artisnal regexes.
-        retval['multiline_regex'] = r'spec:(.*?):end'
-        retval['number_subregex'] = r'(?P<number>[\d.]+):'
-        retval['text_subregex'] = r'[\d.]+:(.*)'
-    else:
-        assert 'file_extension' in retval
-        assert 'multiline_regex' in retval
-        assert 'number_subregex' in retval
-        assert 'text_subregex' in retval
-    return cast(Config, retval)
+# With an `inline_comment_prefix`, annotations are `spec:<number>:<text>:end` comments and these
+# regexes take the place of artisanal ones.
+INLINE_COMMENT_REGEXES = {
+    'multiline_regex': r'spec:(.*?):end',
+    'number_subregex': r'(?P<number>[\d.]+):',
+    'text_subregex': r'[\d.]+:(.*)',
+}
 
+_REGEX_FLAGS = {
+    'multiline_regex': re.MULTILINE | re.DOTALL,
+    'number_subregex': 0,
+    'text_subregex': re.MULTILINE | re.DOTALL,
+}
+
+
+class SpecConfig:
+    """
+    A validated .specrc section, with its regexes compiled once and its prefilter marker worked out.
+
+    Raises ConfigError, naming `source`, when a setting is missing or a regex doesn't compile. The
+    number and text regexes may have at most one group, which is what their matches are taken from.
+    """
+
+    __slots__ = ('settings', 'multiline', 'number', 'text', 'marker')
+
+    def __init__(self, settings: Config, source: str = '.specrc') -> None:
+        missing = [key for key in ('file_extension', *_REGEX_FLAGS) if not settings.get(key)]
+        if missing:
+            raise ConfigError(f'{source}: missing {", ".join(missing)}')
+
+        compiled = {}
+        for key, flags in _REGEX_FLAGS.items():
+            try:
+                compiled[key] = re.compile(settings[key], flags)  # type: ignore[literal-required]
+            except re.error as e:
+                raise ConfigError(f'{source}: {key} is not a valid regex: {e}') from None
+            if key != 'multiline_regex' and compiled[key].groups > 1:
+                raise ConfigError(f'{source}: {key} must have at most one group, not {compiled[key].groups}')
+
+        self.settings = settings
+        self.multiline = compiled['multiline_regex']
+        self.number = compiled['number_subregex']
+        self.text = compiled['text_subregex']
+        self.marker = prefilter_marker(settings)
+
+    @property
+    def file_extension(self) -> str:
+        return self.settings['file_extension']
+
+    @property
+    def inline_comment_prefix(self) -> str | None:
+        return self.settings.get('inline_comment_prefix')
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_config(
+    file_extension: str, multiline_regex: str, number_subregex: str, text_subregex: str, prefix: str | None
+) -> SpecConfig:
+    return SpecConfig(
+        {
+            'file_extension': file_extension,
+            'multiline_regex': multiline_regex,
+            'number_subregex': number_subregex,
+            'text_subregex': text_subregex,
+            'inline_comment_prefix': prefix,
+        },
+        '<config>',
+    )
+
+
+def compile_config(config: Config | SpecConfig) -> SpecConfig:
+    """Returns `config` compiled, compiling a plain Config only once however often it is passed in."""
+    if isinstance(config, SpecConfig):
+        return config
+    return _compile_config(
+        config['file_extension'],
+        config['multiline_regex'],
+        config['number_subregex'],
+        config['text_subregex'],
+        config.get('inline_comment_prefix'),
+    )
+
+
+def get_spec_configs(code_dir: str) -> list[SpecConfig]:
+    """
+    Reads the .specrc in `code_dir`, which holds one config per file extension.
+
+    A plain repository only has a `[spec]` section. Polyglot ones add a `[spec.<extension>]` section
+    per language, whose file_extension defaults to that name and whose other settings default to
+    those in `[spec]`; `[spec]` itself then only counts as a config if it sets a file_extension.
+    """
+    path = os.path.join(code_dir, '.specrc')
+    parser = configparser.ConfigParser(comment_prefixes=(), interpolation=None)
+    try:
+        with open(path) as f:
+            parser.read_file(f)
+    except configparser.Error as e:
+        raise ConfigError(f'{path}: {e}') from None
+
+    base = dict(parser['spec']) if parser.has_section('spec') else {}
+    sections: list[tuple[str, dict[str, str]]] = [
+        (name, {**base, 'file_extension': name[len('spec.') :], **parser[name]})
+        for name in parser.sections()
+        if name.startswith('spec.')
+    ]
+    if base.get('file_extension') or (base and not sections):
+        sections.insert(0, ('spec', base))
+    if not sections:
+        raise ConfigError(f'{path}: no [spec] or [spec.<extension>] section')
+
+    configs = []
+    for name, section in sections:
+        settings: Config = {
+            'file_extension': section.get('file_extension', ''),
+            'multiline_regex': section.get('multiline_regex', ''),
+            'number_subregex': section.get('number_subregex', ''),
+            'text_subregex': section.get('text_subregex', ''),
+            'inline_comment_prefix': section.get('inline_comment_prefix'),
+        }
+        if settings['inline_comment_prefix'] is not None:
+            settings.update(INLINE_COMMENT_REGEXES)  # type: ignore[typeddict-item]
+        configs.append(SpecConfig(settings, f'{path} [{name}]'))
+
+    extensions = [config.file_extension for config in configs]
+    if duplicated := sorted({extension for extension in extensions if extensions.count(extension) > 1}):
+        raise ConfigError(f'{path}: more than one config for {", ".join(duplicated)}')
+    return configs
+
+
+DEFAULT_SPEC_SOURCE = 'https://raw.githubusercontent.com/open-feature/spec/main/specification.json'
+
+# Bump whenever the layout of the spec cache directory changes.
+SPEC_CACHE_LAYOUT = 'v1'
+
+
+class SpecFetchError(Exception):
+    pass
+
+
+def default_spec_cache_dir() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'openfeature-spec')
+
+
+def _is_url(source: str) -> bool:
+    return source.startswith(('http://', 'https://'))
+
+
+def fetch_spec(source: str, cache_dir: str | None = None, timeout: float = 30) -> str:
+    """
+    Returns the path of a local copy of the spec at `source`.
+
+    `source` is a URL, a specification.json file or a directory holding one. Local sources are
+    used in place. URLs are downloaded into a directory per URL below `cache_dir`, streamed
+    straight to disk, and re-validated with If-None-Match / If-Modified-Since on later calls, so an
+    unchanged spec isn't downloaded twice. If the server can't be reached or answers with an error,
+    a cached copy is used.
+    """
+    if not _is_url(source):
+        path = os.path.join(source, 'specification.json') if os.path.isdir(source) else source
+        if not os.path.isfile(path):
+            raise SpecFetchError(f'No specification found at {path}')
+        return path
+
+    target_dir = os.path.join(
+        cache_dir or default_spec_cache_dir(),
+        SPEC_CACHE_LAYOUT,
+        hashlib.sha256(source.encode('utf-8')).hexdigest()[:16],
+    )
+    os.makedirs(target_dir, exist_ok=True)
+    spec_path = os.path.join(target_dir, 'specification.json')
+    meta_path = os.path.join(target_dir, 'meta.json')
+
+    meta: dict[str, str] = {}
+    if os.path.isfile(spec_path) and os.path.isfile(meta_path):
+        # unreadable metadata only costs a full download
+        try:
+            with open(meta_path) as f:
+                loaded = json.load(f)
+        except ValueError:
+            loaded = None
+        if isinstance(loaded, dict):
+            meta = loaded
+
+    request = urllib.request.Request(source)
+    if etag := meta.get('etag'):
+        request.add_header('If-None-Match', etag)
+    if last_modified := meta.get('last_modified'):
+        request.add_header('If-Modified-Since', last_modified)
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            if response.status != 200:
+                raise urllib.error.HTTPError(source, response.status, response.reason, response.headers, None)
+            partial_path = spec_path + '.partial'
+            with open(partial_path, 'wb') as f:
+                shutil.copyfileobj(response, f)
+            os.replace(partial_path, spec_path)
+            meta = {'url': source}
+            if etag := response.headers.get('ETag'):
+                meta['etag'] = etag
+            if last_modified := response.headers.get('Last-Modified'):
+                meta['last_modified'] = last_modified
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and meta:
+            return spec_path
+        if not meta:
+            raise SpecFetchError(f'Fetching {source} failed with HTTP {e.code}') from e
+        print(f'Could not fetch {source} (HTTP {e.code}), using the cached copy')
+    except urllib.error.URLError as e:
+        if not meta:
+            raise SpecFetchError(f'Fetching {source} failed: {e.reason}') from e
+        print(f'Could not reach {source} ({e.reason}), using the cached copy')
+    return spec_path
+
+
+def get_spec_path(
+    force_refresh: bool = False,
+    path_prefix: str = './',
+    source: str | None = None,
+    cache_dir: str | None = None,
+) -> str:
+    """
+    Returns the path of the spec to check against.
+
+    With a `source`, that is the spec as returned by fetch_spec(). Otherwise it is the
+    specification.json in `path_prefix`, which is (re)fetched from the default source when it is
+    missing or `force_refresh` is set.
+    """
+    if source is not None:
+        return fetch_spec(source, cache_dir)
 
-def get_spec(force_refresh: bool = False, path_prefix: str = './') -> dict[str, Any]:
     spec_path = os.path.join(path_prefix, 'specification.json')
     print('Going to look in ', spec_path)
-    if os.path.exists(spec_path) and not force_refresh:
-        with open(spec_path) as f:
-            data = ''.join(f.readlines())
-    else:
-        # TODO: Status code check
-        spec_response = urllib.request.urlopen(
-            'https://raw.githubusercontent.com/open-feature/spec/main/specification.json'
-        )
-        raw = []
-        for i in spec_response.readlines():
-            raw.append(i.decode('utf-8'))
-        data = ''.join(raw)
-        with open(spec_path, 'w') as f:
-            f.write(data)
-    return cast('dict[str, Any]', json.loads(data))
+    if not os.path.exists(spec_path) or force_refresh:
+        with open(fetch_spec(DEFAULT_SPEC_SOURCE, cache_dir), 'rb') as src, open(spec_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    return spec_path
+
+
+def get_spec(force_refresh: bool = False, path_prefix: str = './') -> dict[str, Any]:
+    return load_specification(get_spec_path(force_refresh, path_prefix)).data
+
+
+_number_finder = re.compile(r'[\d.]+')
+
+
+class Specification:
+    """
+    A parsed specification.json, indexed by rule number, machine id, section and RFC 2119 keyword.
+
+    Every index covers rules at any depth. The section of `Requirement 1.1.2.1` is `1.1`.
+    """
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        self.data = data
+        self.rules: list[Rule] = list(_walk_rules(data['rules']))
+        self.by_number: dict[str, Rule] = {}
+        self.by_machine_id: dict[str, Rule] = {}
+        self.by_section: dict[str, list[Rule]] = {}
+        self.by_keyword: dict[str | None, list[Rule]] = {}
+
+        for rule in self.rules:
+            self.by_machine_id[rule['machine_id']] = rule
+            self.by_keyword.setdefault(rule['RFC 2119 keyword'], []).append(rule)
+            if number := rule_number(rule):
+                self.by_number[number] = rule
+                self.by_section.setdefault('.'.join(number.split('.')[:2]), []).append(rule)
+
+    @classmethod
+    def from_file(cls, path: str) -> Specification:
+        with open(path) as f:
+            return cls(json.load(f))
+
+    @functools.cached_property
+    def digest(self) -> str:
+        """A hash of the rules, which changes with every new version of the spec."""
+        return hashlib.sha256(json.dumps(self.data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @functools.cached_property
+    def spec_map(self) -> dict[str, str]:
+        """Maps the number of every requirement to its text, without markdown."""
+        spec_map = {}
+        for rule in self.rules:
+            if 'requirement' in rule['machine_id']:
+                if number := rule_number(rule):
+                    spec_map[number] = _demarkdown(rule['content'])
+                else:
+                    print(f'Skipping invalid ID {rule["id"]}')
+        return spec_map
+
+
+def _walk_rules(rules: list[Rule]) -> Iterator[Rule]:
+    stack = list(reversed(rules))
+    while stack:
+        rule = stack.pop()
+        yield rule
+        stack.extend(reversed(rule['children']))
+
+
+def rule_number(rule: Rule) -> str | None:
+    if number := _number_finder.search(rule['id']):
+        return number.group()
+    return None
+
+
+def load_specification(path: str) -> Specification:
+    """
+    Loads the specification at `path`, reusing the copy already loaded by this process while the
+    file is unchanged.
+    """
+    stat = os.stat(path)
+    return _load_specification(os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_specification(path: str, mtime_ns: int, size: int) -> Specification:
+    return Specification.from_file(path)
 
 
 def specmap_from_file(actual_spec: dict[str, Any]) -> dict[str, str]:
-    spec_map = {}
-    for entry in actual_spec['rules']:
-        if 'requirement' in entry['machine_id']:
-            if number := re.search(r'[\d.]+', entry['id']):
-                spec_map[number.group()] = _demarkdown(entry['content'])
+    return Specification(actual_spec).spec_map
+
+
+class LiteralDecodeError(ValueError):
+    """Raised when annotation text isn't a well-formed (concatenation of) string literal(s)."""
+
+    def __init__(self, message: str, offset: int) -> None:
+        super().__init__(f'{message} at offset {offset}')
+        self.offset = offset
+
+
+_SIMPLE_ESCAPES = {
+    'n': '\n',
+    't': '\t',
+    'r': '\r',
+    'b': '\b',
+    'f': '\f',
+    'v': '\v',
+    '0': '\0',
+    '\\': '\\',
+    '"': '"',
+    "'": "'",
+    '`': '`',
+}
+_HEX_ESCAPE_LENGTHS = {'x': 2, 'u': 4, 'U': 8}
+_CONCAT_OPERATORS = ('..', '+', '.', '&')
+# Everything up to the next closing quote or escape, per kind of quote.
+_LITERAL_RUNS = {'"': re.compile(r'[^"\\]+'), "'": re.compile(r"[^'\\]+")}
+
+
+def decode_string_literal(text: str) -> str:
+    """
+    Decodes annotation text that sits inside a double quoted string literal.
+
+    The literal may be closed and reopened, with a concatenation operator (`+`, `.`, `..`, `&`) or
+    just whitespace in between, e.g. `first half " + "second half`. Common escapes are decoded and
+    unknown ones are kept as-is. This replaces `eval('"%s"' % text)`, without evaluating anything.
+    """
+    out: list[str] = []
+    quote = '"'
+    i = 0
+    n = len(text)
+    while True:
+        # inside a literal
+        while i < n:
+            if run := _LITERAL_RUNS[quote].match(text, i):
+                out.append(run.group())
+                i = run.end()
+                continue
+            if text[i] == quote:
+                break
+
+            escape = text[i + 1 : i + 2]
+            if escape in _HEX_ESCAPE_LENGTHS:
+                digits = text[i + 2 : i + 2 + _HEX_ESCAPE_LENGTHS[escape]]
+                try:
+                    if len(digits) != _HEX_ESCAPE_LENGTHS[escape]:
+                        raise ValueError(digits)
+                    out.append(chr(int(digits, 16)))
+                except ValueError:
+                    raise LiteralDecodeError(f'invalid \\{escape} escape', i) from None
+                i += 2 + len(digits)
+            elif escape:
+                out.append(_SIMPLE_ESCAPES.get(escape, '\\' + escape))
+                i += 2
             else:
-                print(f'Skipping invalid ID {entry["id"]}')
-
-        if entry['children']:
-            for ch in entry['children']:
-                if 'requirement' in ch['machine_id']:
-                    if number := re.search(r'[\d.]+', ch['id']):
-                        spec_map[number.group()] = _demarkdown(ch['content'])
-                    else:
-                        print(f'Skipping invalid child ID {ch["id"]}')
-    return spec_map
-
-
-def find_covered_specs(config: Config, data: str) -> dict[str, str]:
-    repo_specs = {}
-    for match in re.findall(config['multiline_regex'], data, re.MULTILINE | re.DOTALL):
-        match = match.replace('\n', '').replace(config['inline_comment_prefix'], '')
+                raise LiteralDecodeError('dangling backslash', i)
+
+        if i == n:
+            if quote != '"':
+                raise LiteralDecodeError('unterminated string literal', i)
+            return ''.join(out)
+
+        # between literals: whitespace, at most one concatenation operator, then the next quote
+        i += 1
+        while i < n and text[i].isspace():
+            i += 1
+        for operator in _CONCAT_OPERATORS:
+            if text.startswith(operator, i):
+                i += len(operator)
+                break
+        while i < n and text[i].isspace():
+            i += 1
+        if i == n or text[i] not in '"\'':
+            raise LiteralDecodeError('expected another string literal', i)
+        quote = text[i]
+        i += 1
+
+
+_selection_pattern = re.compile(r'\d+(\.\d+)*(\.\*)?')
+
+
+def validate_selection(selection: Iterable[str]) -> list[str]:
+    """Returns the selection patterns that aren't requirement numbers or section prefixes like `4.*`."""
+    return [pattern for pattern in selection if not _selection_pattern.fullmatch(pattern)]
+
+
+def is_selected(number: str, selection: Sequence[str] | None) -> bool:
+    """
+    Tells whether `number` is picked by any of the `selection` patterns; everything is without one.
+
+    `1.3` picks 1.3 itself and everything below it such as 1.3.1, while `4.*` only picks what is below 4.
+    """
+    if not selection:
+        return True
+    for pattern in selection:
+        if pattern.endswith('.*'):
+            if number.startswith(pattern[:-1]):
+                return True
+        elif number == pattern or number.startswith(pattern + '.'):
+            return True
+    return False
+
+
+def find_covered_specs(
+    config: Config | SpecConfig, data: str, path: str = '<string>', selection: Sequence[str] | None = None
+) -> dict[str, str]:
+    """Returns the text of every annotation in `data` by number, skipping numbers outside `selection`."""
+    return covered_specs(_find_annotations(config, data, path, selection)[0])
+
+
+def find_annotations(
+    config: Config | SpecConfig, data: str, path: str = '<string>', selection: Sequence[str] | None = None
+) -> list[Annotation]:
+    """Returns every annotation in `data` in order, with the line and column (both 1-based) it starts at."""
+    return _find_annotations(config, data, path, selection)[0]
+
+
+def covered_specs(annotations: Iterable[Annotation]) -> dict[str, str]:
+    """Maps the numbers of `annotations` to their text; of a number annotated twice, the last one wins."""
+    return {annotation['number']: annotation['text'] for annotation in annotations}
+
+
+_extra_spaces = re.compile(' {2,}')
+
+
+def _find_annotations(
+    config: Config | SpecConfig, data: str, path: str, selection: Sequence[str] | None
+) -> tuple[list[Annotation], int]:
+    """find_annotations(), which also returns how many times `multiline_regex` matched."""
+    compiled = compile_config(config)
+    inline_comment_prefix = compiled.inline_comment_prefix
+    annotations: list[Annotation] = []
+    matches = 0
+    # matches come in order, so lines are counted from the previous one on
+    line = 1
+    counted = 0
+    for found in compiled.multiline.finditer(data):
+        matches += 1
+        start = found.start()
+        line += data.count('\n', counted, start)
+        counted = start
+        match = found.group(1) if compiled.multiline.groups else found.group()
+        match = match.replace('\n', '')
+        if inline_comment_prefix:
+            match = match.replace(inline_comment_prefix, '')
         # normalize whitespace
-        match = re.sub(' {2,}', ' ', match.strip())
-        number = re.findall(config['number_subregex'], match)[0]
+        match = _extra_spaces.sub(' ', match.strip())
+        number = compiled.number.findall(match)[0]
+        if not is_selected(number, selection):
+            continue
 
-        text_with_concat_chars = re.findall(config['text_subregex'], match, re.MULTILINE | re.DOTALL)
+        text_with_concat_chars = compiled.text.findall(match)
         try:
-            text = ''.join(text_with_concat_chars).strip()
-            # We have to match for ") to capture text with parens inside, so we add the trailing " back in.
-            text = _demarkdown(eval('"%s"' % text))
-            repo_specs[number] = text
-        except Exception as e:
-            print(f"Skipping {match} b/c we couldn't parse it")
+            text = decode_string_literal(''.join(text_with_concat_chars).strip())
+        except LiteralDecodeError as e:
+            print(f"{path}:{line}: Skipping {number} b/c we couldn't parse its text: {e}")
+            continue
+        annotations.append(
+            {'number': number, 'text': _demarkdown(text), 'line': line, 'column': start - data.rfind('\n', 0, start)}
+        )
+    return annotations, matches
+
+
+def iter_source_files(root: str, file_extension: str) -> Iterator[str]:
+    """Yields the paths below `root` whose name ends in `.{file_extension}`, as they are found."""
+    suffix = '.%s' % file_extension
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if name.endswith(suffix):
+                yield os.path.join(dirpath, name)
+
+
+_REGEX_SPECIAL = frozenset('.^$*+?{}[]|()')
+
+# Files at least this large are memory-mapped instead of read when looking for the prefilter marker.
+MMAP_THRESHOLD = 1 << 20
+
+
+def prefilter_marker(config: Config | SpecConfig) -> bytes:
+    """
+    Returns a literal that every match of `multiline_regex` starts with, e.g. `spec:` for inline comments.
+
+    Files without it can't contain annotations and are skipped before decoding. An empty marker
+    disables the prefilter, which happens when the regex doesn't start with a plain literal.
+    """
+    pattern = (config.settings if isinstance(config, SpecConfig) else config)['multiline_regex']
+    depth = 0
+    in_class = escaped = False
+    for ch in pattern:
+        if escaped:
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif in_class:
+            in_class = ch != ']'
+        elif ch == '[':
+            in_class = True
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == '|' and depth == 0:
+            # top-level alternatives don't share a prefix
+            return b''
+
+    literal = []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\':
+            escaped_ch = pattern[i + 1 : i + 2]
+            if not escaped_ch or escaped_ch.isalnum():
+                # a character class (\d), an anchor (\b) or a back reference
+                break
+            literal.append(escaped_ch)
+            i += 2
+        elif ch in _REGEX_SPECIAL:
+            break
+        else:
+            literal.append(ch)
+            i += 1
+
+    if literal and pattern[i : i + 1] in ('*', '?', '{'):
+        # the last character is optional or repeated
+        literal.pop()
+    return ''.join(literal).encode('utf-8')
+
+
+def read_if_marked(path: str, marker: bytes) -> str | None:
+    """Returns the decoded content of the file, or None if it doesn't contain `marker`."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        if size < MMAP_THRESHOLD:
+            raw = f.read()
+            if marker not in raw:
+                return None
+            return raw.decode('utf-8', errors='replace')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped.find(marker) == -1:
+                return None
+            return mapped[:].decode('utf-8', errors='replace')
+
+
+def scan_file(
+    config: Config | SpecConfig, path: str, marker: bytes | None = None, selection: Sequence[str] | None = None
+) -> FileCoverage:
+    started = time.perf_counter()
+    if marker is None:
+        marker = compile_config(config).marker
+    data = read_if_marked(path, marker)
+    annotations, matches = _find_annotations(config, data, path, selection) if data is not None else ([], 0)
+    if _hooks:
+        # read_if_marked() looks through every byte of the file, marker or not, as scan_file_cached() does
+        _report_file(path, started, os.path.getsize(path), matches)
+    return {'specs': covered_specs(annotations), 'annotations': annotations}
+
+
+def scan_file_cached(
+    config: Config | SpecConfig,
+    path: str,
+    marker: bytes,
+    cached: CacheEntry | None,
+) -> CacheEntry:
+    """
+    Like scan_file(), but reuses `cached` while the file is unchanged.
+
+    A matching size and mtime is trusted as-is; otherwise the content hash decides. Every annotation
+    is kept, as the cache serves runs with any selection.
+    """
+    started = time.perf_counter()
+    stat = os.stat(path)
+    if cached is not None and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        if _hooks:
+            _report_file(path, started, 0, 0)
+        return cached
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+
+    matches = 0
+    if cached is not None and cached['sha256'] == digest:
+        specs, annotations = cached['specs'], cached['annotations']
+    elif marker in raw:
+        annotations, matches = _find_annotations(config, raw.decode('utf-8', errors='replace'), path, None)
+        specs = covered_specs(annotations)
+    else:
+        specs, annotations = {}, []
+    if _hooks:
+        _report_file(path, started, len(raw), matches)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': digest,
+        'specs': specs,
+        'annotations': annotations,
+    }
+
+
+def _map_paths(task: Callable[[str], T], paths: Iterable[str], workers: int | None) -> dict[str, T]:
+    """Runs `task` for every path in a pool of `workers` threads while `paths` is still being produced."""
+    if workers == 1:
+        return {path: task(path) for path in paths}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {path: executor.submit(task, path) for path in paths}
+        return {path: future.result() for path, future in futures.items()}
+
+
+def scan_files(
+    config: Config | SpecConfig,
+    paths: Iterable[str],
+    workers: int | None = None,
+    cache: CoverageCache | None = None,
+    root: str = '.',
+    selection: Sequence[str] | None = None,
+) -> dict[str, dict[str, str]]:
+    """
+    Returns the covered specs of each file, keyed by path.
+
+    Files are scanned by a pool of `workers` threads while `paths` is still being produced. With a
+    `cache`, unchanged files are not rescanned and the cache is left holding exactly the scanned
+    files, keyed by their path relative to `root`. A cache holds every annotation, so it can't be
+    combined with a `selection`; apply that to what is returned instead.
+    """
+    coverage = scan_coverage(config, paths, workers, cache, root, selection)
+    return {path: file_coverage['specs'] for path, file_coverage in coverage.items()}
+
+
+def scan_coverage(
+    config: Config | SpecConfig,
+    paths: Iterable[str],
+    workers: int | None = None,
+    cache: CoverageCache | None = None,
+    root: str = '.',
+    selection: Sequence[str] | None = None,
+) -> dict[str, FileCoverage]:
+    """Like scan_files(), but returns every file's annotations with their locations along with its covered specs."""
+    config = compile_config(config)
+    marker = config.marker
+    if cache is None:
+        return _map_paths(lambda path: scan_file(config, path, marker, selection), paths, workers)
+    if selection:
+        raise ValueError('a coverage cache holds every annotation, so it cannot be scanned with a selection')
+
+    previous = cache['files']
+    entries = _map_paths(
+        lambda path: scan_file_cached(config, path, marker, previous.get(os.path.relpath(path, root))),
+        paths,
+        workers,
+    )
+    cache['files'] = {os.path.relpath(path, root): entry for path, entry in entries.items()}
+    return dict(entries)
+
+
+class GitDiffError(Exception):
+    pass
+
+
+def changed_files(code_directory: str, base_ref: str) -> list[str]:
+    """
+    Returns the files changed since `base_ref`, relative to `code_directory`, as listed by `git diff`.
+
+    Raises GitDiffError, with what git said, when git fails, e.g. for an unknown ref or outside a repository.
+    """
+    try:
+        result = subprocess.run(
+            ['git', 'diff', '--name-only', '--relative', base_ref, '--'],
+            cwd=code_directory,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        raise GitDiffError(f'git diff {base_ref} failed in {code_directory}: {e.stderr.strip()}') from None
+    except OSError as e:
+        raise GitDiffError(f'git diff {base_ref} failed in {code_directory}: {e}') from None
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def rescan_changed_files(
+    config: Config | SpecConfig,
+    code_directory: str,
+    changed: Iterable[str],
+    cache: CoverageCache,
+    workers: int | None = None,
+) -> dict[str, FileCoverage]:
+    """
+    Returns the coverage of each file like scan_coverage(), but only rescans the `changed` files.
+
+    Every other file's coverage is taken from `cache` as-is. `changed` holds paths relative to
+    `code_directory`; files that no longer exist are dropped from the cache.
+    """
+    suffix = '.%s' % compile_config(config).file_extension
+    touched = {os.path.normpath(path) for path in changed if path.endswith(suffix)}
+
+    partial: CoverageCache = {
+        'version': cache['version'],
+        'key': cache['key'],
+        'files': {path: entry for path, entry in cache['files'].items() if path in touched},
+    }
+    existing = [os.path.join(code_directory, path) for path in sorted(touched)]
+    existing = [path for path in existing if os.path.isfile(path)]
+    scan_coverage(config, existing, workers, partial, code_directory)
+
+    files = {path: entry for path, entry in cache['files'].items() if path not in touched}
+    files.update(partial['files'])
+    cache['files'] = files
+    return {os.path.join(code_directory, path): entry for path, entry in files.items()}
+
+
+def gen_report_delta(before: Report, after: Report) -> ReportDelta:
+    """Compares two reports of the same spec, e.g. for a base ref and the working tree."""
+    return {
+        'newly-covered': sorted(set(before['missing']) - set(after['missing'])),
+        'newly-missing': sorted(set(after['missing']) - set(before['missing'])),
+        'text-regressions': sorted(set(before['good']) & set(after['different-text'])),
+    }
+
+
+def coverage_cache_key(configs: Config | SpecConfig | list[SpecConfig], spec: Specification) -> str:
+    """
+    Identifies what cached coverage depends on besides the files: the .specrc regexes and the spec.
+
+    The cache always holds every annotation, so runs limited to some numbers share it with full ones.
+    """
+    if not isinstance(configs, list):
+        configs = [compile_config(configs)]
+    settings = [
+        {
+            'file_extension': config.file_extension,
+            'multiline_regex': config.settings['multiline_regex'],
+            'number_subregex': config.settings['number_subregex'],
+            'text_subregex': config.settings['text_subregex'],
+            'inline_comment_prefix': config.inline_comment_prefix,
+        }
+        for config in configs
+    ]
+    payload = json.dumps({'configs': settings, 'spec': spec.digest}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_coverage_cache(path: str, key: str) -> CoverageCache:
+    """Loads the coverage cache, or an empty one if it is missing, unreadable or was made for another key."""
+    empty: CoverageCache = {'version': COVERAGE_CACHE_VERSION, 'key': key, 'files': {}}
+    if not os.path.isfile(path):
+        return empty
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except ValueError:
+        return empty
+    if not isinstance(cache, dict) or cache.get('version') != COVERAGE_CACHE_VERSION or cache.get('key') != key:
+        return empty
+    return cast(CoverageCache, cache)
+
+
+def save_coverage_cache(path: str, cache: CoverageCache) -> None:
+    with open(path, 'w') as f:
+        json.dump(cache, f)
+
+
+def merge_coverage(per_file: dict[str, dict[str, str]]) -> dict[str, str]:
+    """Merges per-file coverage in path order, so a number covered twice always resolves the same way."""
+    repo_specs: dict[str, str] = {}
+    for path in sorted(per_file):
+        repo_specs |= per_file[path]
     return repo_specs
 
 
-def gen_report(from_spec: dict[str, str], from_repo: dict[str, str]) -> Report:
+_QUOTES = str.maketrans({'\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"'})
+
+# Rules that text differences are checked against, beyond _demarkdown(), applied in this order.
+NORMALIZERS: dict[str, Callable[[str], str]] = {
+    'quotes': lambda t: t.translate(_QUOTES),
+    'punctuation': lambda t: re.sub(r'[^\w\s]', '', t),
+    'case': str.lower,
+    'whitespace': lambda t: ' '.join(t.split()),
+}
+DEFAULT_NORMALIZERS = ('quotes', 'whitespace')
+
+# Runs of unchanged words longer than this are shortened in compact diffs.
+DIFF_CONTEXT_WORDS = 3
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_text(text: str, rules: tuple[str, ...] = DEFAULT_NORMALIZERS) -> str:
+    """Applies the named NORMALIZERS to `text`. Cached, as the spec side is normalized over and over."""
+    for name in NORMALIZERS:
+        if name in rules:
+            text = NORMALIZERS[name](text)
+    return text
+
+
+def diff_texts(official: str, ours: str, rules: tuple[str, ...] = DEFAULT_NORMALIZERS) -> TextDiff:
+    """
+    Compares two texts of a requirement word by word.
+
+    The difference is `cosmetic` if the texts are equal once normalized with `rules` and
+    `substantive` otherwise. `similarity` is the ratio of matching words, and `diff` shows the
+    changed words as `[-removed-]` / `{+added+}` with long unchanged runs shortened. Without the
+    `whitespace` rule, texts only differing in whitespace are substantive with no changed words.
+    """
+    normalized_official = normalize_text(official, rules)
+    normalized_ours = normalize_text(ours, rules)
+    if normalized_official == normalized_ours:
+        return {'kind': 'cosmetic', 'similarity': 1.0, 'diff': ' '.join(normalized_official.split())}
+
+    official_words = normalized_official.split()
+    our_words = normalized_ours.split()
+
+    matcher = difflib.SequenceMatcher(None, official_words, our_words, autojunk=False)
+    parts = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            words = official_words[i1:i2]
+            if len(words) > 2 * DIFF_CONTEXT_WORDS:
+                head = words[:DIFF_CONTEXT_WORDS] if i1 else []
+                tail = words[-DIFF_CONTEXT_WORDS:] if i2 < len(official_words) else []
+                words = [*head, '...', *tail]
+            parts.append(' '.join(words))
+            continue
+        if i2 > i1:
+            parts.append('[-%s-]' % ' '.join(official_words[i1:i2]))
+        if j2 > j1:
+            parts.append('{+%s+}' % ' '.join(our_words[j1:j2]))
+    return {'kind': 'substantive', 'similarity': round(matcher.ratio(), 3), 'diff': ' '.join(parts)}
+
+
+def gen_report(
+    from_spec: dict[str, str], from_repo: dict[str, str], normalizers: tuple[str, ...] = DEFAULT_NORMALIZERS
+) -> Report:
+    """
+    Sorts the numbers by how the repository covers them.
+
+    Texts that differ are compared with diff_texts(), and the result is kept in `text-diffs`. Texts
+    that are equal once normalized with `normalizers` are `cosmetic-text` rather than `different-text`.
+    """
     extra = set()
     different_text = set()
+    cosmetic_text = set()
     good = set()
+    text_diffs = {}
 
     missing = set(from_spec.keys())  # assume they're all missing
 
@@ -128,6 +1166,10 @@ def gen_report(from_spec: dict[str, str], from_repo: dict[str, str]) -> Report:
             continue
         if text == from_spec[number]:
             good.add(number)
+            continue
+        text_diffs[number] = diff_texts(from_spec[number], text, normalizers)
+        if text_diffs[number]['kind'] == 'cosmetic':
+            cosmetic_text.add(number)
         else:
             different_text.add(number)
 
@@ -135,46 +1177,349 @@ def gen_report(from_spec: dict[str, str], from_repo: dict[str, str]) -> Report:
         'extra': sorted(extra),
         'missing': sorted(missing),
         'different-text': sorted(different_text),
+        'cosmetic-text': sorted(cosmetic_text),
         'good': sorted(good),
+        'text-diffs': {number: text_diffs[number] for number in sorted(text_diffs)},
     }
 
 
-def main(
+def gen_coverage_index(
     code_directory: str,
+    per_file: dict[str, list[Annotation]],
+    spec_map: dict[str, str],
+    normalizers: tuple[str, ...] = DEFAULT_NORMALIZERS,
+) -> CoverageIndex:
+    """
+    Lists every place each number is annotated: the file, relative to `code_directory`, line and column.
+
+    Unlike merge_coverage(), nothing is dropped. Numbers annotated more than once are `duplicates`,
+    and those among them whose texts disagree are `conflicts` too. Each annotation has a status
+    like the sections of gen_report(), with the same `normalizers`.
+    """
+    requirements: dict[str, list[CoverageLocation]] = {}
+    for path in sorted(per_file):
+        relative = os.path.relpath(path, code_directory).replace(os.sep, '/')
+        for annotation in per_file[path]:
+            number, text = annotation['number'], annotation['text']
+            if number not in spec_map:
+                status = 'extra'
+            elif text == spec_map[number]:
+                status = 'good'
+            elif diff_texts(spec_map[number], text, normalizers)['kind'] == 'cosmetic':
+                status = 'cosmetic-text'
+            else:
+                status = 'different-text'
+            requirements.setdefault(number, []).append(
+                {
+                    'path': relative,
+                    'line': annotation['line'],
+                    'column': annotation['column'],
+                    'text': text,
+                    'status': status,
+                }
+            )
+
+    requirements = {number: requirements[number] for number in sorted(requirements, key=_number_key)}
+    return {
+        'code_directory': code_directory,
+        'requirements': requirements,
+        'missing': sorted(set(spec_map) - set(requirements)),
+        'duplicates': [number for number, locations in requirements.items() if len(locations) > 1],
+        'conflicts': [
+            number
+            for number, locations in requirements.items()
+            if len({location['text'] for location in locations}) > 1
+        ],
+    }
+
+
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+
+# What gen_sarif() reports about an annotation, by rule id: the level and a description.
+SARIF_RULES = {
+    'different-text': ('error', 'The annotation text differs from the spec'),
+    'extra': ('error', 'The annotated number is not a requirement of the spec'),
+    'cosmetic-text': ('note', 'The annotation text only differs cosmetically from the spec'),
+    'conflicting-text': ('warning', 'The number is annotated elsewhere with another text'),
+    'duplicate': ('note', 'The number is annotated elsewhere too'),
+}
+
+
+def gen_sarif(index: CoverageIndex) -> dict[str, Any]:
+    """
+    Renders what is wrong with the annotations in `index` as a SARIF 2.1.0 log for code review tools.
+
+    Every finding is a result at the annotation it is about. Missing requirements have no location
+    and are left out.
+    """
+    conflicts = set(index['conflicts'])
+    results = []
+    for number, locations in index['requirements'].items():
+        for location in locations:
+            rule_ids = [location['status']] if location['status'] != 'good' else []
+            elsewhere = ', '.join(f'{other["path"]}:{other["line"]}' for other in locations if other is not location)
+            if elsewhere:
+                rule_ids.append('conflicting-text' if number in conflicts else 'duplicate')
+            for rule_id in rule_ids:
+                level, description = SARIF_RULES[rule_id]
+                message = f'{number}: {description}'
+                if rule_id in ('conflicting-text', 'duplicate'):
+                    message += f' ({elsewhere})'
+                results.append(
+                    {
+                        'ruleId': rule_id,
+                        'level': level,
+                        'message': {'text': message},
+                        'locations': [
+                            {
+                                'physicalLocation': {
+                                    'artifactLocation': {'uri': location['path']},
+                                    'region': {'startLine': location['line'], 'startColumn': location['column']},
+                                }
+                            }
+                        ],
+                    }
+                )
+
+    rules = [
+        {'id': rule_id, 'shortDescription': {'text': description}, 'defaultConfiguration': {'level': level}}
+        for rule_id, (level, description) in SARIF_RULES.items()
+    ]
+    return {
+        '$schema': SARIF_SCHEMA,
+        'version': '2.1.0',
+        'runs': [{'tool': {'driver': {'name': 'spec_finder', 'rules': rules}}, 'results': results}],
+    }
+
+
+def _cache_parts(configs: list[SpecConfig], cache: CoverageCache) -> Iterator[tuple[SpecConfig, CoverageCache]]:
+    """
+    Yields every config with the part of `cache` holding its files, to be scanned one after the other.
+
+    Once they all have been, `cache` holds what the parts were left holding.
+    """
+    files: dict[str, CacheEntry] = {}
+    for config in configs:
+        suffix = '.%s' % config.file_extension
+        part: CoverageCache = {
+            'version': cache['version'],
+            'key': cache['key'],
+            'files': {path: entry for path, entry in cache['files'].items() if path.endswith(suffix)},
+        }
+        yield config, part
+        files.update(part['files'])
+    cache['files'] = files
+
+
+def select_coverage(coverage: FileCoverage, selection: Sequence[str] | None) -> FileCoverage:
+    """Returns the part of a file's coverage that the `selection` picks."""
+    if not selection:
+        return coverage
+    annotations = [annotation for annotation in coverage['annotations'] if is_selected(annotation['number'], selection)]
+    return {'specs': covered_specs(annotations), 'annotations': annotations}
+
+
+def scan_repository(
+    code_directory: str,
+    spec: Specification,
+    workers: int | None = None,
+    cache_file: str | None = None,
+    base_ref: str | None = None,
+    selection: Sequence[str] | None = None,
+    normalizers: tuple[str, ...] = DEFAULT_NORMALIZERS,
+) -> RepositoryCoverage:
+    """
+    Scans the repository in `code_directory`, as configured by its .specrc, and reports its coverage of `spec`.
+
+    With a `selection`, only the requirements it picks are reported. Other annotations are still
+    scanned and cached, so that the cache can serve later runs with another or no selection.
+    """
+    configs = get_spec_configs(code_directory)
+    spec_map = {number: text for number, text in spec.spec_map.items() if is_selected(number, selection)}
+    cache = None
+    if cache_file:
+        with phase('load cache'):
+            cache = load_coverage_cache(cache_file, coverage_cache_key(configs, spec))
+    baseline = None
+    per_file: dict[str, FileCoverage] = {}
+    if base_ref and cache is not None and cache['files']:
+        # the cache is the baseline here, so it is only read
+        baseline = gen_report(
+            spec_map,
+            merge_coverage(
+                {path: select_coverage(entry, selection)['specs'] for path, entry in cache['files'].items()}
+            ),
+            normalizers,
+        )
+        with phase('git diff'):
+            changed = changed_files(code_directory, base_ref)
+        with phase('scan'):
+            for config, part in _cache_parts(configs, cache):
+                per_file.update(rescan_changed_files(config, code_directory, changed, part, workers))
+    else:
+        if base_ref:
+            print('No baseline coverage in the cache file yet, scanning everything')
+        with phase('scan'):
+            # walking is interleaved with scanning, so the two are one phase
+            parts: Iterable[tuple[SpecConfig, CoverageCache | None]] = (
+                _cache_parts(configs, cache) if cache is not None else [(config, None) for config in configs]
+            )
+            for config, cached in parts:
+                paths = iter_source_files(code_directory, config.file_extension)
+                # without a cache to fill, annotations outside the selection are skipped right away
+                selected = selection if cached is None else None
+                per_file.update(scan_coverage(config, paths, workers, cached, code_directory, selected))
+        if cache_file and cache is not None:
+            with phase('save cache'):
+                save_coverage_cache(cache_file, cache)
+
+    with phase('gen_report'):
+        per_file = {path: select_coverage(coverage, selection) for path, coverage in per_file.items()}
+        repo_specs = merge_coverage({path: coverage['specs'] for path, coverage in per_file.items()})
+        report = gen_report(from_spec=spec_map, from_repo=repo_specs, normalizers=normalizers)
+        index = gen_coverage_index(
+            code_directory,
+            {path: coverage['annotations'] for path, coverage in per_file.items()},
+            spec_map,
+            normalizers,
+        )
+    return {
+        'code_directory': code_directory,
+        'configs': configs,
+        'repo_specs': repo_specs,
+        'report': report,
+        'baseline': baseline,
+        'files': len(per_file),
+        'index': index,
+    }
+
+
+def _sdk_names(code_directories: list[str]) -> list[str]:
+    """Names each repository after its directory, falling back to the path as given when names clash."""
+    names = [os.path.basename(os.path.abspath(d)) for d in code_directories]
+    return [name if names.count(name) == 1 else d for name, d in zip(names, code_directories)]
+
+
+def gen_matrix(reports: dict[str, Report], spec_map: dict[str, str]) -> CoverageMatrix:
+    """Combines the reports of several SDKs into the status of every requirement per SDK."""
+    requirements: dict[str, dict[str, str]] = {number: {} for number in sorted(spec_map, key=_number_key)}
+    for sdk, report in reports.items():
+        for status in ('good', 'cosmetic-text', 'different-text', 'missing'):
+            for number in report[status]:
+                requirements[number][sdk] = status
+    return {
+        'sdks': list(reports),
+        'requirements': requirements,
+        'extra': {sdk: report['extra'] for sdk, report in reports.items()},
+    }
+
+
+def _number_key(number: str) -> list[int]:
+    return [int(part) for part in number.split('.') if part.isdigit()]
+
+
+_MATRIX_SYMBOLS = {'good': '+', 'cosmetic-text': '=', 'different-text': '~', 'missing': '-'}
+
+
+def format_matrix(matrix: CoverageMatrix) -> str:
+    """Renders the matrix as a plain text table, one row per requirement and one column per SDK."""
+    header = ['requirement', *matrix['sdks']]
+    rows = [
+        [number, *(_MATRIX_SYMBOLS[statuses[sdk]] for sdk in matrix['sdks'])]
+        for number, statuses in matrix['requirements'].items()
+    ]
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [header, *rows]]
+    lines.append('+ good, = cosmetic difference, ~ different text, - missing')
+    return '\n'.join(lines)
+
+
+def batch_main(
+    code_directories: list[str],
     refresh_spec: bool = False,
+    spec_source: str | None = None,
+    spec_cache_dir: str | None = None,
+    workers: int | None = None,
+    matrix_report: str | None = None,
     diff_output: bool = False,
-    limit_numbers: str | None = None,
-    json_report: bool = False,
-) -> None:
-    actual_spec = get_spec(refresh_spec, path_prefix=code_directory)
-    config = get_spec_parser(code_directory)
+    normalizers: tuple[str, ...] = DEFAULT_NORMALIZERS,
+) -> int:
+    """
+    Checks several repositories against one spec, loaded once, and prints a requirement x SDK matrix.
 
-    spec_map = specmap_from_file(actual_spec)
+    Each repository has its own .specrc. Returns the number of problems found across all of them.
+    """
+    with phase('load spec'):
+        spec = load_specification(get_spec_path(refresh_spec, './', spec_source, spec_cache_dir))
+    names = _sdk_names(code_directories)
+
+    with ThreadPoolExecutor(max_workers=len(code_directories)) as executor:
+        futures = {
+            name: executor.submit(scan_repository, code_directory, spec, workers, normalizers=normalizers)
+            for name, code_directory in zip(names, code_directories)
+        }
+        reports = {name: future.result()['report'] for name, future in futures.items()}
 
-    repo_specs: dict[str, str] = {}
     bad_num = 0
+    for name, report in reports.items():
+        bad_num += len(report['different-text']) + len(report['extra']) + len(report['missing'])
+        print(
+            f'{name}: {len(report["good"])} good, {len(report["cosmetic-text"])} cosmetic differences, '
+            f'{len(report["different-text"])} different text, {len(report["missing"])} missing, '
+            f'{len(report["extra"])} extra'
+        )
+        if diff_output:
+            for number in report['different-text']:
+                text_diff = report['text-diffs'][number]
+                print(f'  {number}: {text_diff["similarity"]:.0%} similar: {text_diff["diff"]}')
+
+    matrix = gen_matrix(reports, spec.spec_map)
+    print(format_matrix(matrix))
+    if matrix_report:
+        with phase('write json'), open(matrix_report, 'w') as f:
+            f.write(json.dumps(matrix, indent=4))
+    return bad_num
 
-    for root, dirs, files in os.walk('.', topdown=False):
-        for name in files:
-            F = os.path.join(root, name)
-            if ('.%s' % config['file_extension']) not in name:
-                continue
-            with open(F) as f:
-                data = ''.join(f.readlines())
 
-            repo_specs |= find_covered_specs(config, data)
+def main(
+    code_directory: str,
+    refresh_spec: bool = False,
+    diff_output: bool = False,
+    limit_numbers: Sequence[str] | None = None,
+    json_report: bool = False,
+    workers: int | None = None,
+    cache_file: str | None = None,
+    base_ref: str | None = None,
+    spec_source: str | None = None,
+    spec_cache_dir: str | None = None,
+    normalizers: tuple[str, ...] = DEFAULT_NORMALIZERS,
+    index_file: str | None = None,
+    sarif_file: str | None = None,
+) -> None:
+    started = time.perf_counter()
+    with phase('load spec'):
+        spec = load_specification(get_spec_path(refresh_spec, code_directory, spec_source, spec_cache_dir))
+    spec_map = spec.spec_map
+    loaded = time.perf_counter()
 
-    report = gen_report(from_spec=spec_map, from_repo=repo_specs)
+    coverage = scan_repository(code_directory, spec, workers, cache_file, base_ref, limit_numbers, normalizers)
+    extensions = '-'.join(config.file_extension for config in coverage['configs'])
+    baseline = coverage['baseline']
+    scanned = time.perf_counter()
+
+    bad_num = 0
+    report = coverage['report']
 
     for number in report['different-text']:
         bad_num += 1
         print(f'{number} is bad.')
         if diff_output:
-            print('Official:')
-            print('\t%s' % spec_map[number])
-            print('')
-            print('Ours:')
-            print('\t%s' % repo_specs[number])
+            text_diff = report['text-diffs'][number]
+            print(f'\t{text_diff["kind"]}, {text_diff["similarity"]:.0%} similar: {text_diff["diff"]}')
+
+    # equal once normalized, so not counted as bad
+    for number in report['cosmetic-text']:
+        print(f'{number} only differs cosmetically.')
 
     bad_num += len(report['extra'])
     for number in report['extra']:
@@ -187,11 +1532,44 @@ def main(
         for m in sorted(missing):
             print(f'  {m}: {spec_map[m]}')
 
+    index = coverage['index']
+    for number in index['conflicts']:
+        places = ', '.join(f'{location["path"]}:{location["line"]}' for location in index['requirements'][number])
+        print(f'{number} is annotated with different texts at {places}')
+
     if json_report:
-        report_txt = json.dumps(report, indent=4)
-        loc = os.path.join(code_directory, '%s-report.json' % config['file_extension'])
-        with open(loc, 'w') as f:
-            f.write(report_txt)
+        loc = os.path.join(code_directory, '%s-report.json' % extensions)
+        with phase('write json'), open(loc, 'w') as f:
+            f.write(json.dumps(report, indent=4))
+    if index_file:
+        with phase('write json'), open(index_file, 'w') as f:
+            f.write(json.dumps(index, indent=4))
+    if sarif_file:
+        with phase('write json'), open(sarif_file, 'w') as f:
+            f.write(json.dumps(gen_sarif(index), indent=4))
+
+    if baseline is not None:
+        delta = gen_report_delta(baseline, report)
+        changes = [
+            ('newly covered', delta['newly-covered']),
+            ('newly missing', delta['newly-missing']),
+            ('text regressions', delta['text-regressions']),
+        ]
+        print(f'Compared to {base_ref}: ' + ', '.join(f'{len(numbers)} {kind}' for kind, numbers in changes))
+        for kind, numbers in changes:
+            if numbers:
+                print(f'  {kind}: {", ".join(numbers)}')
+        if json_report:
+            loc = os.path.join(code_directory, '%s-delta.json' % extensions)
+            with phase('write json'), open(loc, 'w') as f:
+                f.write(json.dumps(delta, indent=4))
+
+    finished = time.perf_counter()
+    print(
+        f'Loaded the spec in {loaded - started:.2f}s, '
+        f'scanned {coverage["files"]} files in {scanned - loaded:.2f}s, '
+        f'reported in {finished - scanned:.2f}s'
+    )
     sys.exit(bad_num)
 
 
@@ -200,16 +1578,123 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Parse the spec to make sure our tests cover it')
     parser.add_argument('--refresh-spec', action='store_true', help='Re-downloads the spec')
+    parser.add_argument(
+        '--spec-source',
+        action='store',
+        help='URL, file or directory to take the spec from instead of ${code-directory}/specification.json',
+    )
+    parser.add_argument(
+        '--spec-cache-dir',
+        action='store',
+        help='where downloaded specs are cached (default: ~/.cache/openfeature-spec)',
+    )
     parser.add_argument('--diff-output', action='store_true', help='print the text differences')
-    parser.add_argument('--code-directory', action='store', required=True, help='directory to find code in')
+    parser.add_argument(
+        '--normalize',
+        action='store',
+        default=','.join(DEFAULT_NORMALIZERS),
+        help='comma separated rules a difference must survive to be substantive, out of: %s (default: %%(default)s)'
+        % ', '.join(NORMALIZERS),
+    )
+    parser.add_argument(
+        '--code-directory',
+        action='append',
+        required=True,
+        help='directory to find code in; repeat it to check several repositories against one spec',
+    )
+    parser.add_argument(
+        '--matrix-report', action='store', help='with several code directories, store the combined matrix as json'
+    )
     parser.add_argument('--json-report', action='store_true', help='Store a json report into ${extension}-report.json')
-    parser.add_argument('specific_numbers', metavar='num', type=str, nargs='*', help='limit this to specific numbers')
+    parser.add_argument(
+        '--index', action='store', metavar='FILE', help='store the file, line and column of every annotation as json'
+    )
+    parser.add_argument(
+        '--sarif', action='store', metavar='FILE', help='store the problems found as SARIF, at the annotations'
+    )
+    parser.add_argument('--workers', action='store', type=int, help='number of threads to scan files with')
+    parser.add_argument(
+        '--cache-file', action='store', help='reuse the coverage of unchanged files, stored in this file'
+    )
+    parser.add_argument(
+        '--base-ref',
+        action='store',
+        help='only rescan files changed since this git ref, using --cache-file from a full run as the baseline',
+    )
+    parser.add_argument(
+        'specific_numbers',
+        metavar='num',
+        type=str,
+        nargs='*',
+        help='limit this to specific numbers and sections, e.g. 1.3.1, 1.3 (1.3 and below) or 4.* (below 4)',
+    )
+    parser.add_argument(
+        '--timings',
+        nargs='?',
+        const='-',
+        metavar='FILE',
+        help='print where the time went to stderr, and store it as a json trace in FILE if given',
+    )
+    parser.add_argument('--profile', metavar='FILE', help='store cProfile stats of the run in FILE')
 
     args = parser.parse_args()
-    main(
-        code_directory=args.code_directory,
-        refresh_spec=args.refresh_spec,
-        diff_output=args.diff_output,
-        limit_numbers=args.specific_numbers,
-        json_report=args.json_report,
-    )
+    if args.base_ref and not args.cache_file:
+        parser.error('--base-ref needs a --cache-file to hold the baseline coverage')
+    script = os.path.basename(__file__)
+    if script in args.specific_numbers:
+        # `docker run specfinder spec_finder.py ...` names the script the image already runs, which used to be ignored
+        print(f'Ignoring the extra {script} argument, it is not a requirement number', file=sys.stderr)
+        args.specific_numbers = [number for number in args.specific_numbers if number != script]
+    if invalid := validate_selection(args.specific_numbers):
+        parser.error(f'not a requirement number or section: {", ".join(invalid)}')
+    normalizers = tuple(rule for rule in args.normalize.split(',') if rule)
+    if unknown := set(normalizers) - set(NORMALIZERS):
+        parser.error(f'unknown --normalize rules: {", ".join(sorted(unknown))}')
+    with instrumented(args.timings, args.profile):
+        try:
+            if len(args.code_directory) > 1:
+                if (
+                    args.base_ref
+                    or args.cache_file
+                    or args.json_report
+                    or args.index
+                    or args.sarif
+                    or args.specific_numbers
+                ):
+                    parser.error(
+                        '--base-ref, --cache-file, --json-report, --index, --sarif and numbers only apply to a single '
+                        'code directory'
+                    )
+                sys.exit(
+                    batch_main(
+                        code_directories=args.code_directory,
+                        refresh_spec=args.refresh_spec,
+                        spec_source=args.spec_source,
+                        spec_cache_dir=args.spec_cache_dir,
+                        workers=args.workers,
+                        matrix_report=args.matrix_report,
+                        diff_output=args.diff_output,
+                        normalizers=normalizers,
+                    )
+                )
+            main(
+                code_directory=args.code_directory[0],
+                refresh_spec=args.refresh_spec,
+                diff_output=args.diff_output,
+                limit_numbers=args.specific_numbers,
+                json_report=args.json_report,
+                workers=args.workers,
+                cache_file=args.cache_file,
+                base_ref=args.base_ref,
+                spec_source=args.spec_source,
+                spec_cache_dir=args.spec_cache_dir,
+                normalizers=normalizers,
+                index_file=args.index,
+                sarif_file=args.sarif,
+            )
+        except ConfigError as e:
+            parser.exit(2, f'{e}\n')
+        except SpecFetchError as e:
+            parser.exit(1, f'{e}\n')
+        except GitDiffError as e:
+            parser.exit(2, f'{e}\n')
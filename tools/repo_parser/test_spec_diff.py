@@ -0,0 +1,106 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from spec_diff import diff_specifications, main
+from spec_finder import Specification
+
+
+def _rule(number: str, content: str, kind: str = 'Requirement', children: list[dict] | None = None) -> dict:
+    rule_id = f'{kind} {number}'
+    keyword = next((word for word in ('MUST', 'SHOULD', 'MAY') if word in content), None)
+    return {
+        'id': rule_id,
+        'machine_id': rule_id.lower().replace(' ', '_').replace('.', '_'),
+        'content': content,
+        'RFC 2119 keyword': keyword,
+        'children': children or [],
+    }
+
+
+OLD = {
+    'rules': [
+        _rule('1.1', 'The API MUST be a singleton.'),
+        _rule('1.2', 'Clients MUST be created by the API.'),
+        _rule('1.3', 'The client MUST expose typed evaluation methods for booleans, strings and numbers.'),
+        _rule(
+            '1.4',
+            'If the language has generics.',
+            'Condition',
+            [_rule('1.4.1', 'The client MAY expose a generic method.', 'Conditional Requirement')],
+        ),
+        _rule('1.5', 'Hooks MUST run in order.'),
+    ]
+}
+
+
+def test_identical_specs_have_no_changes():
+    changelog = diff_specifications(Specification(OLD), Specification(OLD))
+    assert changelog['changes'] == []
+    assert set(changelog['summary'].values()) == {0}
+
+
+def test_classifies_every_kind_of_change():
+    new = {
+        'rules': [
+            _rule('1.1', 'The API  MUST be a “singleton”.'),
+            _rule('1.2', 'The client MUST expose typed evaluation methods for booleans, strings and numbers.'),
+            _rule(
+                '1.3',
+                'If the language has generics.',
+                'Condition',
+                [_rule('1.3.1', 'The client SHOULD expose a generic method.', 'Conditional Requirement')],
+            ),
+            _rule('1.4', 'Hooks MUST run in their order.'),
+            _rule('1.6', 'Providers MUST have a name.'),
+        ]
+    }
+    changelog = diff_specifications(Specification(OLD), Specification(new), old_name='v1', new_name='v2')
+
+    changes = [(change['change'], change['old_id'], change['new_id']) for change in changelog['changes']]
+    assert changes == [
+        ('renumbered', 'Requirement 1.3', 'Requirement 1.2'),
+        ('removed', 'Requirement 1.2', None),
+        ('renumbered', 'Condition 1.4', 'Condition 1.3'),
+        ('renumbered', 'Conditional Requirement 1.4.1', 'Conditional Requirement 1.3.1'),
+        ('renumbered', 'Requirement 1.5', 'Requirement 1.4'),
+        ('added', None, 'Requirement 1.6'),
+    ]
+    assert changelog['summary'] == {
+        'added': 1,
+        'removed': 1,
+        'renumbered': 4,
+        'reworded': 0,
+        'keyword changes': 1,
+    }
+    generic = changelog['changes'][3]
+    assert (generic['old_keyword'], generic['new_keyword']) == ('MAY', 'SHOULD')
+    assert generic['diff'] == 'The client [-MAY-] {+SHOULD+} expose a generic method.'
+
+
+def test_same_number_with_new_text_is_reworded():
+    new = {'rules': [*OLD['rules'][:4], _rule('1.5', 'Hooks MUST NOT be skipped.')]}
+    [change] = diff_specifications(Specification(OLD), Specification(new))['changes']
+    assert change['change'] == 'reworded'
+    assert change['old_id'] == change['new_id'] == 'Requirement 1.5'
+    assert change['diff'] == 'Hooks MUST [-run in order.-] {+NOT be skipped.+}'
+
+
+def test_main_diffs_each_version_with_the_next(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    versions = [OLD, {'rules': OLD['rules'][:4]}, {'rules': OLD['rules'][1:4]}]
+    sources = []
+    for i, version in enumerate(versions):
+        (tmp_path / f'v{i}').mkdir()
+        (tmp_path / f'v{i}' / 'specification.json').write_text(json.dumps(version))
+        sources.append(str(tmp_path / f'v{i}'))
+
+    main(sources, json_output=str(tmp_path / 'changelog.json'))
+
+    changelogs = json.loads((tmp_path / 'changelog.json').read_text())
+    assert [(changelog['old'], changelog['new']) for changelog in changelogs] == list(zip(sources, sources[1:]))
+    assert [[change['old_id'] for change in changelog['changes']] for changelog in changelogs] == [
+        ['Requirement 1.5'],
+        ['Requirement 1.1'],
+    ]
+    assert '0 added, 1 removed' in capsys.readouterr().out
@@ -1,4 +1,53 @@
-from spec_finder import Config, find_covered_specs, gen_report, specmap_from_file
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+import spec_finder
+from spec_finder import (
+    Config,
+    ConfigError,
+    GitDiffError,
+    LiteralDecodeError,
+    SpecFetchError,
+    Specification,
+    Timings,
+    add_hook,
+    batch_main,
+    changed_files,
+    compile_config,
+    coverage_cache_key,
+    decode_string_literal,
+    diff_texts,
+    fetch_spec,
+    find_annotations,
+    find_covered_specs,
+    gen_coverage_index,
+    gen_report,
+    gen_report_delta,
+    gen_sarif,
+    get_spec_configs,
+    instrumented,
+    is_selected,
+    iter_source_files,
+    load_coverage_cache,
+    load_specification,
+    main,
+    merge_coverage,
+    prefilter_marker,
+    remove_hook,
+    save_coverage_cache,
+    scan_files,
+    specmap_from_file,
+    validate_selection,
+)
 
 
 def test_simple_singleline():
@@ -126,3 +175,827 @@ def test_specmap_from_file():
         spec_map['2.2.2.1']
         == 'The feature provider interface MUST define methods for typed flag resolution, including boolean, numeric, string, and structure.'
     )
+
+
+def _rule(rule_id: str, keyword: str | None = 'MUST', children: list[dict] | None = None) -> dict:
+    return {
+        'id': rule_id,
+        'machine_id': rule_id.lower().replace(' ', '_').replace('.', '_'),
+        'content': f'{rule_id} **{keyword}** be `indexed`.',
+        'RFC 2119 keyword': keyword,
+        'children': children or [],
+    }
+
+
+def test_specification_indexes_nested_rules():
+    spec = Specification(
+        {
+            'rules': [
+                _rule('Requirement 1.1.1'),
+                _rule(
+                    'Condition 1.2.1',
+                    None,
+                    [_rule('Condition 1.2.1.1', None, [_rule('Conditional Requirement 1.2.1.1.1', 'MAY')])],
+                ),
+                _rule('Requirement 2.1.1', 'SHOULD'),
+            ]
+        }
+    )
+
+    assert spec.by_number['1.2.1.1.1']['machine_id'] == 'conditional_requirement_1_2_1_1_1'
+    assert spec.by_machine_id['condition_1_2_1_1']['id'] == 'Condition 1.2.1.1'
+    assert [r['id'] for r in spec.by_section['1.2']] == [
+        'Condition 1.2.1',
+        'Condition 1.2.1.1',
+        'Conditional Requirement 1.2.1.1.1',
+    ]
+    assert [r['id'] for r in spec.by_keyword['SHOULD']] == ['Requirement 2.1.1']
+    assert spec.spec_map == {
+        '1.1.1': 'Requirement 1.1.1 MUST be indexed.',
+        '1.2.1.1.1': 'Conditional Requirement 1.2.1.1.1 MAY be indexed.',
+        '2.1.1': 'Requirement 2.1.1 SHOULD be indexed.',
+    }
+
+
+def test_load_specification_is_memoized_until_the_file_changes(tmp_path: Path):
+    path = tmp_path / 'specification.json'
+    path.write_text(json.dumps({'rules': [_rule('Requirement 1.1.1')]}))
+
+    first = load_specification(str(path))
+    assert load_specification(str(path)) is first
+
+    path.write_text(json.dumps({'rules': [_rule('Requirement 1.1.1'), _rule('Requirement 1.1.2')]}))
+    os.utime(path, ns=(0, 0))
+    second = load_specification(str(path))
+    assert second is not first
+    assert list(second.by_number) == ['1.1.1', '1.1.2']
+
+
+RUST_CONFIG: Config = {
+    'file_extension': 'rs',
+    'multiline_regex': r'spec:(.*?):end',
+    'number_subregex': r'(?P<number>[\d.]+):',
+    'text_subregex': r'[\d.]+:(.*)',
+    'inline_comment_prefix': '//',
+}
+
+
+RUST_SPECRC = '[spec]\nfile_extension=rs\ninline_comment_prefix=//\n'
+
+
+def _write_repo(root: Path, files: dict[str, str]) -> None:
+    for name, content in files.items():
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text(content)
+
+
+def _write_rust_repo(root: Path, rules: list[dict], files: dict[str, str]) -> None:
+    """Writes a rust repository annotated like RUST_CONFIG, with a specification holding `rules`."""
+    _write_repo(root, {'specification.json': json.dumps({'rules': rules}), '.specrc': RUST_SPECRC, **files})
+
+
+def test_iter_source_files_matches_the_exact_extension(tmp_path: Path):
+    _write_repo(tmp_path, {'a.rs': '', 'nested/b.rs': '', 'c.rsx': '', 'd.rs.bak': ''})
+
+    found = sorted(os.path.relpath(p, tmp_path) for p in iter_source_files(str(tmp_path), 'rs'))
+    assert found == ['a.rs', os.path.join('nested', 'b.rs')]
+
+
+def test_threaded_scan_matches_serial_scan(tmp_path: Path):
+    _write_repo(tmp_path, {f'{i}.rs': f'// spec:1.1.{i}:text {i}:end\n' for i in range(20)})
+    paths = list(iter_source_files(str(tmp_path), 'rs'))
+
+    threaded = scan_files(RUST_CONFIG, paths, workers=4)
+    assert threaded == scan_files(RUST_CONFIG, paths, workers=1)
+    assert merge_coverage(threaded) == {f'1.1.{i}': f'text {i}' for i in range(20)}
+
+
+def test_merge_coverage_is_deterministic():
+    assert merge_coverage({'b.rs': {'1.1': 'from b'}, 'a.rs': {'1.1': 'from a'}}) == {'1.1': 'from b'}
+
+
+def test_main_scans_the_code_directory(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1'), _rule('Requirement 1.1.2')],
+        {
+            'src/lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n',
+        },
+    )
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(code_directory=str(tmp_path), workers=2)
+
+    assert exit_info.value.code == 1
+    out = capsys.readouterr().out
+    assert '1.1.2: Requirement 1.1.2 MUST be indexed.' in out
+    assert 'scanned 1 files in' in out
+
+
+@pytest.mark.parametrize(
+    ('specrc', 'error'),
+    [
+        ('[spec]\nfile_extension=rs\n', 'missing multiline_regex, number_subregex, text_subregex'),
+        ('[spec]\nfile_extension=rs\nmultiline_regex=(\nnumber_subregex=x\ntext_subregex=x\n', 'not a valid regex'),
+        ('[spec]\nfile_extension=rs\nmultiline_regex=x\nnumber_subregex=(a)(b)\ntext_subregex=x\n', 'at most one'),
+        ('[other]\nfile_extension=rs\n', 'no [spec]'),
+        (
+            '[spec]\ninline_comment_prefix=//\n[spec.rs]\n[spec.rust]\nfile_extension=rs\n',
+            'more than one config for rs',
+        ),
+    ],
+)
+def test_get_spec_configs_rejects_invalid_specrc(tmp_path: Path, specrc: str, error: str):
+    (tmp_path / '.specrc').write_text(specrc)
+    with pytest.raises(ConfigError, match=re.escape(error)):
+        get_spec_configs(str(tmp_path))
+
+
+def test_compile_config_compiles_a_config_once():
+    config: Config = {
+        'file_extension': 'rs',
+        'multiline_regex': r'spec:(.*?):end',
+        'number_subregex': r'(?P<number>[\d.]+):',
+        'text_subregex': r'[\d.]+:(.*)',
+        'inline_comment_prefix': '//',
+    }
+    compiled = compile_config(config)
+    assert compile_config(dict(config)) is compiled  # type: ignore[arg-type]
+    assert compile_config(compiled) is compiled
+    assert find_covered_specs(compiled, '// spec:1.1:Some text.:end') == find_covered_specs(
+        config, '// spec:1.1:Some text.:end'
+    )
+
+
+def test_get_spec_configs_extension_sections_next_to_a_spec_config(tmp_path: Path):
+    (tmp_path / '.specrc').write_text(
+        '[spec]\nfile_extension=rs\ninline_comment_prefix=//\n[spec.py]\ninline_comment_prefix=#\n'
+    )
+    configs = get_spec_configs(str(tmp_path))
+    assert [(config.file_extension, config.inline_comment_prefix) for config in configs] == [('rs', '//'), ('py', '#')]
+
+
+def test_get_spec_configs_reads_values_without_interpolation(tmp_path: Path):
+    (tmp_path / '.specrc').write_text(
+        '[spec]\nfile_extension=sql\nmultiline_regex=-- %spec (.*?)$\nnumber_subregex=(\\d+)\ntext_subregex=: (.*)\n'
+    )
+    [config] = get_spec_configs(str(tmp_path))
+    assert config.settings['multiline_regex'] == '-- %spec (.*?)$'
+
+
+def test_main_scans_every_language_of_a_polyglot_repository(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    spec = {'rules': [_rule('Requirement 1.1.1'), _rule('Requirement 1.1.2')]}
+    _write_repo(
+        tmp_path,
+        {
+            'specification.json': json.dumps(spec),
+            '.specrc': '[spec]\ninline_comment_prefix=//\n[spec.rs]\n[spec.py]\ninline_comment_prefix=#\n',
+            'src/lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n',
+            'tests/test_lib.py': '# spec:1.1.2:Requirement 1.1.2 MUST be indexed.:end\n',
+        },
+    )
+
+    assert [config.file_extension for config in get_spec_configs(str(tmp_path))] == ['rs', 'py']
+    with pytest.raises(SystemExit) as exit_info:
+        main(code_directory=str(tmp_path), json_report=True)
+
+    assert exit_info.value.code == 0
+    assert 'scanned 2 files in' in capsys.readouterr().out
+    report = json.loads((tmp_path / 'rs-py-report.json').read_text())
+    assert report['good'] == ['1.1.1', '1.1.2']
+
+
+@pytest.mark.parametrize(
+    ('number', 'selected'),
+    [('1.3', True), ('1.3.1', True), ('1.31', False), ('4', False), ('4.2', True), ('4.2.1', True), ('2.1', False)],
+)
+def test_is_selected(number: str, selected: bool):
+    assert is_selected(number, ['1.3', '4.*']) is selected
+    assert is_selected(number, None)
+
+
+def test_validate_selection():
+    assert validate_selection(['1.3', '4.*', '1.2.3']) == []
+    assert validate_selection(['1.*.2', 'abc', '1.']) == ['1.*.2', 'abc', '1.']
+
+
+def test_main_only_reports_the_selected_numbers(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1'), _rule('Requirement 1.2.1'), _rule('Requirement 2.1.1')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n// spec:2.1.1:Unrelated text.:end\n',
+        },
+    )
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(code_directory=str(tmp_path), json_report=True, limit_numbers=['1.*'])
+
+    assert exit_info.value.code == 1
+    out = capsys.readouterr().out
+    assert '1.2.1: Requirement 1.2.1 MUST be indexed.' in out
+    assert '2.1.1' not in out
+    report = json.loads((tmp_path / 'rs-report.json').read_text())
+    assert sorted(report['missing']) == ['1.2.1']
+    assert report['good'] == ['1.1.1']
+
+
+def test_selection_skips_annotations_without_a_cache(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n// spec:2.1.1:Not " decodable.:end\n',
+        },
+    )
+    with pytest.raises(SystemExit):
+        main(code_directory=str(tmp_path), limit_numbers=['1.*'])
+    assert 'Skipping 2.1.1' not in capsys.readouterr().out
+
+    cache = load_coverage_cache(str(tmp_path / 'cache.json'), 'key')
+    with pytest.raises(ValueError, match='selection'):
+        scan_files(RUST_CONFIG, [str(tmp_path / 'lib.rs')], 1, cache, str(tmp_path), ['1.*'])
+
+
+def test_selected_runs_share_the_coverage_cache(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1'), _rule('Requirement 2.1.1')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n// spec:2.1.1:Unrelated text.:end\n',
+        },
+    )
+    cache_file = str(tmp_path / 'cache.json')
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(code_directory=str(tmp_path), cache_file=cache_file, limit_numbers=['1.*'])
+    assert exit_info.value.code == 0
+    cache = json.loads((tmp_path / 'cache.json').read_text())
+    assert cache['files']['lib.rs']['specs'] == {
+        '1.1.1': 'Requirement 1.1.1 MUST be indexed.',
+        '2.1.1': 'Unrelated text.',
+    }
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(code_directory=str(tmp_path), cache_file=cache_file)
+    assert exit_info.value.code == 1
+    assert json.loads((tmp_path / 'cache.json').read_text())['key'] == cache['key']
+    assert '2.1.1 is bad.' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    ('multiline_regex', 'marker'),
+    [
+        (r'spec:(.*?):end', b'spec:'),
+        (r'@Specification\((?P<innards>.*?)\)\s*$', b'@Specification('),
+        (r'\[Specification\((?P<innards>.*?)\)\]', b'[Specification('),
+        (r'it\(["\'](.*)["\']', b'it('),
+        (r'specs?:(.*):end', b'spec'),
+        (r'spec:(a|b)|other:(.*)', b''),
+        (r'\s*spec:(.*)', b''),
+    ],
+)
+def test_prefilter_marker(multiline_regex: str, marker: bytes):
+    assert prefilter_marker(RUST_CONFIG | {'multiline_regex': multiline_regex}) == marker
+
+
+@pytest.mark.parametrize('mmap_threshold', [0, spec_finder.MMAP_THRESHOLD])
+def test_scan_skips_files_without_the_marker(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, mmap_threshold: int):
+    monkeypatch.setattr(spec_finder, 'MMAP_THRESHOLD', mmap_threshold)
+    (tmp_path / 'binary.rs').write_bytes(b'\xff\xfe not utf-8 and no annotations')
+    (tmp_path / 'mixed.rs').write_bytes(b'\xff // spec:1.1.1:caf\xc3\xa9:end\n')
+    (tmp_path / 'empty.rs').write_bytes(b'')
+
+    per_file = scan_files(RUST_CONFIG, sorted(iter_source_files(str(tmp_path), 'rs')), workers=1)
+    assert merge_coverage(per_file) == {'1.1.1': 'caf\u00e9'}
+    assert per_file[str(tmp_path / 'binary.rs')] == {}
+
+
+@pytest.mark.parametrize(
+    'text',
+    [
+        'plain text (with parens)',
+        'first half " + "second half',
+        'implicit " "concatenation',
+        'escaped \\"quotes\\" and \\\\ backslashes',
+        'tab\\tand\\nnewline',
+        'unicode caf\\u00e9 and \\x41',
+        "it's fine",
+        'mixed quotes " + \'single\'"',
+    ],
+)
+def test_decode_string_literal_matches_python(text: str):
+    assert decode_string_literal(text) == eval('"%s"' % text)
+
+
+@pytest.mark.parametrize(
+    'text',
+    ['first " + second', 'dangling \\', 'bad \\u12', 'unterminated " + \'single', '" + __import__("os").getcwd() + "'],
+)
+def test_decode_string_literal_rejects_non_literals(text: str):
+    with pytest.raises(LiteralDecodeError):
+        decode_string_literal(text)
+
+
+def test_concatenation_operators():
+    assert decode_string_literal('php " . "style') == 'php style'
+    assert decode_string_literal('lua " .. "style') == 'lua style'
+    assert decode_string_literal('vb " & "style') == 'vb style'
+
+
+def test_java_annotations(capsys: pytest.CaptureFixture[str]):
+    text = """
+    @Specification(number="1.1.1", text="The API " +
+        "MUST be a \\"singleton\\".")
+    @Test
+    void singleton() {}
+
+    @Specification(number="1.1.2", text="Broken " + SOME_CONSTANT + "text")
+    @Test
+    void broken() {}
+    """
+    cfg: Config = {
+        'file_extension': 'java',
+        'multiline_regex': r'@Specification\((?P<innards>.*?)\)\s*$',
+        'number_subregex': r'number\s*=\s*[\'"](.*?)[\'"]',
+        'text_subregex': r'text\s*=\s*[\'"](.*)[\'"]',
+        'inline_comment_prefix': None,
+    }
+    assert find_covered_specs(cfg, text, 'Test.java') == {'1.1.1': 'The API MUST be a singleton.'}
+    assert "Test.java:7: Skipping 1.1.2 b/c we couldn't parse its text" in capsys.readouterr().out
+
+
+def test_coverage_cache_reuses_unchanged_files(tmp_path: Path):
+    _write_repo(tmp_path, {'a.rs': '// spec:1.1.1:first:end\n', 'b.rs': '// spec:1.1.2:second:end\n'})
+    cache = load_coverage_cache(str(tmp_path / 'cache.json'), 'key')
+
+    scan_files(RUST_CONFIG, sorted(iter_source_files(str(tmp_path), 'rs')), 1, cache, str(tmp_path))
+    assert cache['files']['a.rs']['specs'] == {'1.1.1': 'first'}
+
+    # unchanged files come from the cache, changed and deleted ones don't
+    cache['files']['a.rs']['specs'] = {'1.1.1': 'from cache'}
+    (tmp_path / 'b.rs').write_text('// spec:1.1.2:second, edited:end\n')
+    (tmp_path / 'c.rs').write_text('// spec:1.1.3:third:end\n')
+    save_coverage_cache(str(tmp_path / 'cache.json'), cache)
+    cache = load_coverage_cache(str(tmp_path / 'cache.json'), 'key')
+    (tmp_path / 'a.rs').unlink()
+    (tmp_path / 'a.rs').write_text('// spec:1.1.1:first:end\n')
+    os.utime(tmp_path / 'a.rs', ns=(1, 1))
+
+    per_file = scan_files(RUST_CONFIG, sorted(iter_source_files(str(tmp_path), 'rs')), 1, cache, str(tmp_path))
+    assert merge_coverage(per_file) == {'1.1.1': 'from cache', '1.1.2': 'second, edited', '1.1.3': 'third'}
+    assert sorted(cache['files']) == ['a.rs', 'b.rs', 'c.rs']
+
+
+def test_coverage_cache_is_dropped_for_another_key(tmp_path: Path):
+    spec = Specification({'rules': [_rule('Requirement 1.1.1')]})
+    key = coverage_cache_key(RUST_CONFIG, spec)
+    assert key != coverage_cache_key(RUST_CONFIG | {'text_subregex': r'(.*)'}, spec)
+    assert key != coverage_cache_key(RUST_CONFIG, Specification({'rules': [_rule('Requirement 1.1.2')]}))
+
+    cache = load_coverage_cache(str(tmp_path / 'cache.json'), key)
+    cache['files']['a.rs'] = {'size': 0, 'mtime_ns': 0, 'sha256': '', 'specs': {}, 'annotations': []}
+    save_coverage_cache(str(tmp_path / 'cache.json'), cache)
+    assert load_coverage_cache(str(tmp_path / 'cache.json'), key) == cache
+    assert load_coverage_cache(str(tmp_path / 'cache.json'), 'other')['files'] == {}
+
+
+def test_find_annotations_records_where_each_one_starts():
+    data = 'fn a() {}\n// spec:1.1.1:first:end\n  // spec:1.1.1:again:end // spec:1.1.2:second\n// :end\n'
+    assert find_annotations(RUST_CONFIG, data) == [
+        {'number': '1.1.1', 'text': 'first', 'line': 2, 'column': 4},
+        {'number': '1.1.1', 'text': 'again', 'line': 3, 'column': 6},
+        {'number': '1.1.2', 'text': 'second', 'line': 3, 'column': 30},
+    ]
+    assert find_covered_specs(RUST_CONFIG, data) == {'1.1.1': 'again', '1.1.2': 'second'}
+
+
+def test_coverage_index_keeps_duplicates_and_conflicts(tmp_path: Path):
+    per_file = {
+        str(tmp_path / 'src' / 'b.rs'): [{'number': '1.1.1', 'text': 'other', 'line': 3, 'column': 4}],
+        str(tmp_path / 'a.rs'): [
+            {'number': '1.1.10', 'text': 'ten', 'line': 1, 'column': 4},
+            {'number': '1.1.1', 'text': 'one', 'line': 2, 'column': 4},
+            {'number': '1.1.2', 'text': 'two', 'line': 5, 'column': 4},
+            {'number': '1.1.2', 'text': 'two', 'line': 9, 'column': 8},
+        ],
+    }
+    index = gen_coverage_index(str(tmp_path), per_file, {'1.1.1': 'one', '1.1.2': 'two', '1.1.3': 'three'})
+
+    assert list(index['requirements']) == ['1.1.1', '1.1.2', '1.1.10']
+    assert index['requirements']['1.1.1'] == [
+        {'path': 'a.rs', 'line': 2, 'column': 4, 'text': 'one', 'status': 'good'},
+        {'path': 'src/b.rs', 'line': 3, 'column': 4, 'text': 'other', 'status': 'different-text'},
+    ]
+    assert index['requirements']['1.1.10'][0]['status'] == 'extra'
+    assert (index['missing'], index['duplicates'], index['conflicts']) == (['1.1.3'], ['1.1.1', '1.1.2'], ['1.1.1'])
+
+    results = gen_sarif(index)['runs'][0]['results']
+    assert [(result['ruleId'], result['level']) for result in results] == [
+        ('conflicting-text', 'warning'),
+        ('different-text', 'error'),
+        ('conflicting-text', 'warning'),
+        ('duplicate', 'note'),
+        ('duplicate', 'note'),
+        ('extra', 'error'),
+    ]
+    assert results[1]['locations'][0]['physicalLocation'] == {
+        'artifactLocation': {'uri': 'src/b.rs'},
+        'region': {'startLine': 3, 'startColumn': 4},
+    }
+    assert results[3]['message']['text'] == '1.1.2: The number is annotated elsewhere too (a.rs:9)'
+
+
+def test_main_writes_the_index_from_cached_files_too(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1')],
+        {
+            'src/a.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n',
+            'src/b.rs': '\n    // spec:1.1.1:Requirement 1.1.1 MUST be found.:end\n',
+        },
+    )
+    cache_file, index_file, sarif_file = (str(tmp_path / name) for name in ('cache.json', 'index.json', 'sarif.json'))
+
+    for _ in range(2):
+        with pytest.raises(SystemExit):
+            main(
+                code_directory=str(tmp_path),
+                workers=1,
+                cache_file=cache_file,
+                index_file=index_file,
+                sarif_file=sarif_file,
+            )
+        assert '1.1.1 is annotated with different texts at src/a.rs:1, src/b.rs:2' in capsys.readouterr().out
+        index = json.loads((tmp_path / 'index.json').read_text())
+        assert [
+            (location['path'], location['line'], location['column']) for location in index['requirements']['1.1.1']
+        ] == [
+            ('src/a.rs', 1, 4),
+            ('src/b.rs', 2, 8),
+        ]
+        assert json.loads((tmp_path / 'sarif.json').read_text())['version'] == '2.1.0'
+
+
+def test_gen_report_delta():
+    before = gen_report({'1': 'a', '2': 'b', '3': 'c'}, {'1': 'a', '2': 'b'})
+    after = gen_report({'1': 'a', '2': 'b', '3': 'c'}, {'2': 'b, edited', '3': 'c'})
+    assert gen_report_delta(before, after) == {
+        'newly-covered': ['3'],
+        'newly-missing': ['1'],
+        'text-regressions': ['2'],
+    }
+
+
+def test_changed_files_explains_git_failures(tmp_path: Path):
+    subprocess.run(['git', 'init', '-q'], cwd=tmp_path, check=True)
+    with pytest.raises(GitDiffError, match='git diff no-such-ref failed in .*: fatal: .*no-such-ref'):
+        changed_files(str(tmp_path), 'no-such-ref')
+
+
+def test_base_ref_only_rescans_changed_files(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1'), _rule('Requirement 1.1.2')],
+        {
+            'src/a.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n',
+            'src/b.rs': '// nothing yet\n',
+        },
+    )
+
+    def git(*args: str) -> None:
+        subprocess.run(['git', *args], cwd=tmp_path, check=True, capture_output=True)
+
+    git('init', '-q')
+    git('add', '.')
+    git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', 'base')
+    cache_file = str(tmp_path / 'coverage-cache.json')
+    with pytest.raises(SystemExit):
+        main(code_directory=str(tmp_path), cache_file=cache_file)
+
+    # a.rs is doctored in the baseline only, so it must not be rescanned
+    with open(cache_file) as f:
+        cache = json.load(f)
+    cache['files'][os.path.join('src', 'a.rs')]['specs'] = {'1.1.1': 'Requirement 1.1.1 MUST be indexed.', '9.9': 'x'}
+    with open(cache_file, 'w') as f:
+        json.dump(cache, f)
+    (tmp_path / 'src' / 'b.rs').write_text('// spec:1.1.2:Requirement 1.1.2 MUST be indexed.:end\n')
+    capsys.readouterr()
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(code_directory=str(tmp_path), cache_file=cache_file, base_ref='HEAD')
+
+    out = capsys.readouterr().out
+    assert exit_info.value.code == 1  # 9.9 from the baseline is extra
+    assert 'scanned 2 files' in out
+    assert 'Compared to HEAD: 1 newly covered, 0 newly missing, 0 text regressions' in out
+    assert '  newly covered: 1.1.2' in out
+
+
+class _SpecServer(ThreadingHTTPServer):
+    body = b''
+    etag = '"v1"'
+    status = 200
+    requests: list[str]
+
+
+class _SpecHandler(BaseHTTPRequestHandler):
+    server: _SpecServer
+
+    def do_GET(self) -> None:
+        if self.path != '/specification.json':
+            self.send_error(404)
+            return
+        if self.server.status != 200:
+            self.server.requests.append(str(self.server.status))
+            self.send_error(self.server.status)
+            return
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.server.requests.append('304')
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.requests.append('200')
+        self.send_response(200)
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def spec_server() -> Iterator[_SpecServer]:
+    server = _SpecServer(('127.0.0.1', 0), _SpecHandler)
+    server.requests = []
+    server.body = json.dumps({'rules': [_rule('Requirement 1.1.1')]}).encode()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_spec_revalidates_with_etag(tmp_path: Path, spec_server: _SpecServer):
+    url = f'http://127.0.0.1:{spec_server.server_port}/specification.json'
+
+    path = fetch_spec(url, str(tmp_path))
+    assert json.loads(Path(path).read_text())['rules'][0]['id'] == 'Requirement 1.1.1'
+    assert fetch_spec(url, str(tmp_path)) == path
+    assert spec_server.requests == ['200', '304']
+
+    spec_server.body = json.dumps({'rules': [_rule('Requirement 1.1.2')]}).encode()
+    spec_server.etag = '"v2"'
+    assert json.loads(Path(fetch_spec(url, str(tmp_path))).read_text())['rules'][0]['id'] == 'Requirement 1.1.2'
+    assert spec_server.requests == ['200', '304', '200']
+
+    # a corrupt meta.json is ignored, and the spec downloaded again
+    (Path(path).parent / 'meta.json').write_text('{')
+    assert fetch_spec(url, str(tmp_path)) == path
+    assert spec_server.requests == ['200', '304', '200', '200']
+
+
+def test_fetch_spec_errors_and_offline_fallback(
+    tmp_path: Path, spec_server: _SpecServer, capsys: pytest.CaptureFixture[str]
+):
+    base = f'http://127.0.0.1:{spec_server.server_port}'
+    with pytest.raises(SpecFetchError, match='HTTP 404'):
+        fetch_spec(f'{base}/missing.json', str(tmp_path))
+
+    url = f'{base}/specification.json'
+    spec_server.status = 503
+    with pytest.raises(SpecFetchError, match='HTTP 503'):
+        fetch_spec(url, str(tmp_path))
+
+    spec_server.status = 200
+    path = fetch_spec(url, str(tmp_path))
+    for status in (503, 429):
+        spec_server.status = status
+        assert fetch_spec(url, str(tmp_path)) == path
+        assert f'Could not fetch {url} (HTTP {status}), using the cached copy' in capsys.readouterr().out
+    assert spec_server.requests == ['503', '200', '503', '429']
+
+    spec_server.shutdown()
+    spec_server.server_close()
+    assert fetch_spec(url, str(tmp_path), timeout=1) == path
+
+
+def test_cli_reports_a_missing_spec_without_a_traceback(tmp_path: Path):
+    result = subprocess.run(
+        [
+            sys.executable,
+            spec_finder.__file__,
+            '--code-directory',
+            str(tmp_path),
+            '--spec-source',
+            str(tmp_path / 'no'),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 1
+    assert result.stderr == f'No specification found at {tmp_path / "no"}\n'
+
+
+def test_cli_ignores_the_script_name_passed_again(tmp_path: Path):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n',
+        },
+    )
+    result = subprocess.run(
+        [sys.executable, spec_finder.__file__, 'spec_finder.py', '--code-directory', str(tmp_path)],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0
+    assert 'Ignoring the extra spec_finder.py argument' in result.stderr
+
+
+def test_fetch_spec_local_sources(tmp_path: Path):
+    (tmp_path / 'specification.json').write_text('{"rules": []}')
+    assert fetch_spec(str(tmp_path)) == str(tmp_path / 'specification.json')
+    assert fetch_spec(str(tmp_path / 'specification.json')) == str(tmp_path / 'specification.json')
+    with pytest.raises(SpecFetchError):
+        fetch_spec(str(tmp_path / 'nothing-here'))
+
+
+def test_batch_main_builds_a_matrix(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    spec = {'rules': [_rule('Requirement 1.1.1'), _rule('Requirement 1.1.2'), _rule('Requirement 1.1.10')]}
+    _write_repo(
+        tmp_path,
+        {
+            'specification.json': json.dumps(spec),
+            'rust-sdk/.specrc': RUST_SPECRC,
+            'rust-sdk/lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n// spec:1.1.2:other:end\n',
+            'go-sdk/.specrc': '[spec]\nfile_extension=go\ninline_comment_prefix=//\n',
+            'go-sdk/lib_test.go': '// spec:1.1.10:Requirement 1.1.10 MUST be indexed.:end\n// spec:9.9:x:end\n',
+        },
+    )
+    matrix_path = tmp_path / 'matrix.json'
+
+    bad = batch_main(
+        [str(tmp_path / 'rust-sdk'), str(tmp_path / 'go-sdk')],
+        spec_source=str(tmp_path),
+        matrix_report=str(matrix_path),
+    )
+
+    assert bad == 5
+    assert json.loads(matrix_path.read_text()) == {
+        'sdks': ['rust-sdk', 'go-sdk'],
+        'requirements': {
+            '1.1.1': {'rust-sdk': 'good', 'go-sdk': 'missing'},
+            '1.1.2': {'rust-sdk': 'different-text', 'go-sdk': 'missing'},
+            '1.1.10': {'rust-sdk': 'missing', 'go-sdk': 'good'},
+        },
+        'extra': {'rust-sdk': [], 'go-sdk': ['9.9']},
+    }
+    out = capsys.readouterr().out
+    assert 'rust-sdk: 1 good, 0 cosmetic differences, 1 different text, 1 missing, 0 extra' in out
+    assert 'requirement  rust-sdk  go-sdk\n1.1.1        +         -\n1.1.2        ~         -\n1.1.10' in out
+
+
+def test_batch_main_uses_the_normalizers_and_prints_diffs(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    spec = {'rules': [_rule('Requirement 1.1.1')]}
+    files = {'specification.json': json.dumps(spec)}
+    for sdk, text in (('a', 'requirement 1.1.1 must be indexed.'), ('b', 'Requirement 1.1.1 MUST be found.')):
+        files[f'{sdk}/.specrc'] = RUST_SPECRC
+        files[f'{sdk}/lib.rs'] = f'// spec:1.1.1:{text}:end\n'
+    _write_repo(tmp_path, files)
+
+    bad = batch_main(
+        [str(tmp_path / 'a'), str(tmp_path / 'b')],
+        spec_source=str(tmp_path),
+        diff_output=True,
+        normalizers=('case', 'whitespace'),
+    )
+
+    assert bad == 1
+    out = capsys.readouterr().out
+    assert 'a: 0 good, 1 cosmetic differences, 0 different text' in out
+    assert '  1.1.1: 80% similar: requirement 1.1.1 must be [-indexed.-] {+found.+}' in out
+
+
+def test_diff_texts_cosmetic():
+    assert diff_texts('The API  MUST exist.', 'The API MUST exist. ')['kind'] == 'cosmetic'
+    assert diff_texts('It\u2019s required.', "It's required.")['kind'] == 'cosmetic'
+    assert diff_texts('The API  MUST exist.', 'The API MUST exist.', ('quotes',))['kind'] == 'substantive'
+    assert gen_report({'1': 'a b'}, {'1': 'a b '}, ())['different-text'] == ['1']
+    assert diff_texts('The API MUST exist.', 'the api must exist', ('case', 'punctuation', 'whitespace')) == {
+        'kind': 'cosmetic',
+        'similarity': 1.0,
+        'diff': 'the api must exist',
+    }
+
+
+def test_diff_texts_substantive():
+    official = 'The client MUST provide a method for flag evaluation with a default value and an evaluation context.'
+    ours = 'The client SHOULD provide a method for flag evaluation with a default value and a context.'
+    result = diff_texts(official, ours)
+    assert result['kind'] == 'substantive'
+    assert 0.8 < result['similarity'] < 1
+    assert result['diff'] == (
+        'The client [-MUST-] {+SHOULD+} provide a method ... default value and [-an evaluation-] {+a+} context.'
+    )
+
+
+def test_main_prints_word_diffs(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be tested.:end\n',
+        },
+    )
+    with pytest.raises(SystemExit):
+        main(code_directory=str(tmp_path), diff_output=True)
+    assert '\tsubstantive, 80% similar: Requirement 1.1.1 MUST be [-indexed.-] {+tested.+}' in capsys.readouterr().out
+
+
+def test_cosmetic_differences_are_reported_but_not_counted(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement\t1.1.1 MUST be indexed.:end\n',
+        },
+    )
+    with pytest.raises(SystemExit) as exit_info:
+        main(code_directory=str(tmp_path), json_report=True)
+
+    assert exit_info.value.code == 0
+    assert '1.1.1 only differs cosmetically.' in capsys.readouterr().out
+    report = json.loads((tmp_path / 'rs-report.json').read_text())
+    assert (report['different-text'], report['cosmetic-text']) == ([], ['1.1.1'])
+    assert report['text-diffs']['1.1.1']['kind'] == 'cosmetic'
+
+
+def test_gen_report_classifies_with_the_normalizers():
+    spec, repo = {'1': 'The client MUST do it.'}, {'1': 'The client must do it.'}
+    assert gen_report(spec, repo)['different-text'] == ['1']
+    report = gen_report(spec, repo, ('quotes', 'case', 'whitespace'))
+    assert (report['different-text'], report['cosmetic-text']) == ([], ['1'])
+
+
+def test_timings_hook_records_phases_and_files(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1'), _rule('Requirement 1.1.2')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n// spec:1.1.2:Something else.:end\n',
+            'other.rs': 'fn main() {}\n',
+        },
+    )
+    timings = Timings()
+    add_hook(timings)
+    try:
+        with pytest.raises(SystemExit):
+            main(code_directory=str(tmp_path), cache_file=str(tmp_path / 'cache.json'))
+    finally:
+        remove_hook(timings)
+
+    assert {'load spec', 'load cache', 'scan', 'save cache', 'gen_report'} <= set(timings.phases)
+    files = {os.path.basename(file['path']): file for file in timings.files}
+    assert files['lib.rs']['matches'] == 2
+    assert files['lib.rs']['bytes_read'] == (tmp_path / 'lib.rs').stat().st_size
+    assert files['other.rs']['matches'] == 0
+    assert '2 files' in timings.summary()
+
+
+def test_scanned_files_report_the_bytes_they_hold(tmp_path: Path):
+    _write_repo(
+        tmp_path, {'lib.rs': '// spec:1.1.1:Caf\u00e9 \u2018quotes\u2019.:end\n', 'other.rs': 'fn main() {}\n' * 20}
+    )
+    paths = sorted(iter_source_files(str(tmp_path), 'rs'))
+    for cache in (None, load_coverage_cache(str(tmp_path / 'cache.json'), 'key')):
+        timings = Timings()
+        add_hook(timings)
+        try:
+            scan_files(RUST_CONFIG, paths, 1, cache, str(tmp_path))
+        finally:
+            remove_hook(timings)
+        assert {file['path']: file['bytes_read'] for file in timings.files} == {
+            path: os.path.getsize(path) for path in paths
+        }
+
+
+def test_instrumented_writes_a_trace_and_a_profile(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _write_rust_repo(
+        tmp_path,
+        [_rule('Requirement 1.1.1')],
+        {
+            'lib.rs': '// spec:1.1.1:Requirement 1.1.1 MUST be indexed.:end\n',
+        },
+    )
+    trace, profile = tmp_path / 'trace.json', tmp_path / 'run.prof'
+    with pytest.raises(SystemExit), instrumented(str(trace), str(profile)):
+        main(code_directory=str(tmp_path))
+
+    events = json.loads(trace.read_text())['traceEvents']
+    assert {(event['cat'], event['ph']) for event in events} == {('phase', 'X'), ('file', 'X')}
+    assert profile.stat().st_size > 0
+    assert '1 files, ' in capsys.readouterr().err
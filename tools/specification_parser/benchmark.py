@@ -0,0 +1,206 @@
+'''
+Compares the line-based tokenizer against the whole-file regex it replaced.
+
+    python benchmark.py --requirements 20000 --quote-lines 10
+
+With --suite, times the parser's hot paths and the CLI instead, and records the results as json
+so they can be compared between commits:
+
+    python benchmark.py --suite --output before.json
+    python benchmark.py --suite --compare before.json
+'''
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from io import StringIO
+from os import makedirs
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+
+from specification_parser import tokenize, parse, parsed_content_to_hierarchy
+
+SCRIPT = join(dirname(abspath(__file__)), 'specification_parser.py')
+
+# The whole-file pattern parse() used before tokenize() existed.
+legacy_content_finder = re.compile(r'^(?P<level>####+)(?P<headline>[^\n]+)\n+?.*?\n+?(?P<rest>>\s[^#?]*)', re.MULTILINE)
+
+
+def _requirement(out, level, kind, number, quote_lines):
+    out.append(f'{"#" * level} {kind} {number}\n\n')
+    for line in range(quote_lines):
+        out.append(f'> Line {line} of the requirement text, which **MUST** be long enough to matter.\n')
+    out.append('\n```java\nclient.getBooleanValue("flag", false);\n```\n\n')
+
+
+def synthetic_spec(requirements, quote_lines, depth=0, first_section=1):
+    '''
+    Builds a markdown spec with the given number of requirements, each with a long blockquote.
+
+    With a depth, every tenth requirement is a condition with that many levels of nested
+    conditions below it, each holding a conditional requirement.
+    '''
+    out = ['# Synthetic specification\n\n']
+    for i in range(requirements):
+        section, number = divmod(i, 50)
+        section += first_section
+        if number == 0:
+            out.append(f'### {section}. Section\n\nSome prose about the section.\n\n')
+        if depth and number % 10 == 9:
+            prefix = f'{section}.{number + 1}'
+            for level in range(depth):
+                _requirement(out, 4 + level, 'Condition', prefix, quote_lines)
+                _requirement(out, 5 + level, 'Conditional Requirement', f'{prefix}.1', quote_lines)
+                prefix += '.2'
+        else:
+            _requirement(out, 4, 'Requirement', f'{section}.{number + 1}', quote_lines)
+    return ''.join(out)
+
+
+def peak_memory(case):
+    'Returns the peak number of bytes allocated while running case'
+    tracemalloc.start()
+    try:
+        case()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def drain(events):
+    for _ in events:
+        pass
+
+
+def git_commit():
+    'The commit the benchmark runs on, or None outside of a git checkout'
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=dirname(SCRIPT), capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def measure(cases, repeat):
+    'Runs every case `repeat` times and returns the runs in milliseconds by case name'
+    results = {}
+    for name, case in cases.items():
+        runs = [run * 1000 for run in timeit.repeat(case, number=1, repeat=repeat)]
+        results[name] = {'best_ms': round(min(runs), 3), 'runs_ms': [round(run, 3) for run in runs]}
+    return results
+
+
+def report(results, baseline=None):
+    'Prints the best run of every case, and how it changed since the `baseline` results'
+    for name, result in results.items():
+        line = f'{name:>14}: {result["best_ms"]:.1f} ms'
+        before = (baseline or {}).get(name)
+        if before and before['best_ms']:
+            line += f' ({(result["best_ms"] / before["best_ms"] - 1) * 100:+.0f}%)'
+        print(line)
+
+
+def suite(requirements, quote_lines, depth, files, repeat):
+    'Times tokenizing, parsing, building the hierarchy and the CLI on a synthetic spec'
+    spec = synthetic_spec(requirements, quote_lines, depth)
+    tokens = list(tokenize(StringIO(spec)))
+    print(f'{requirements} requirements, {len(spec) / 1024 / 1024:.1f} MiB of markdown in {files} files')
+
+    with TemporaryDirectory() as tmp:
+        path = join(tmp, 'spec.md')
+        with open(path, 'w') as f:
+            f.write(spec)
+
+        repo = join(tmp, 'repo')
+        makedirs(join(repo, 'specification'))
+        per_file = -(-requirements // files)
+        for i in range(files):
+            with open(join(repo, 'specification', f'{i:03}.md'), 'w') as f:
+                f.write(synthetic_spec(per_file, quote_lines, depth, first_section=i * per_file // 50 + 1))
+
+        def cli(*args):
+            subprocess.run([sys.executable, SCRIPT, *args], cwd=repo, check=True, stderr=subprocess.DEVNULL)
+
+        cli('--cache-file', 'cache.json')
+        cases = {
+            'tokenize': lambda: list(tokenize(StringIO(spec))),
+            'hierarchy': lambda: parsed_content_to_hierarchy(tokens),
+            'parse': lambda: parse(path),
+            'cli': lambda: cli(),
+            'cli cached': lambda: cli('--cache-file', 'cache.json'),
+        }
+        return measure(cases, repeat)
+
+
+def main(requirements, quote_lines, repeat):
+    spec = synthetic_spec(requirements, quote_lines)
+    print(f'{requirements} requirements, {len(spec) / 1024 / 1024:.1f} MiB of markdown')
+
+    legacy = parsed_content_to_hierarchy(legacy_content_finder.findall(spec))
+    streamed = parsed_content_to_hierarchy(tokenize(StringIO(spec)))
+    assert legacy == streamed, 'tokenizer and regex disagree on the synthetic spec'
+
+    cases = {
+        'regex': lambda: legacy_content_finder.findall(spec),
+        'tokenize': lambda: list(tokenize(StringIO(spec))),
+    }
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(f'{name:>10}: {best * 1000:.1f} ms')
+
+    with TemporaryDirectory() as tmp:
+        path = join(tmp, 'spec.md')
+        with open(path, 'w') as f:
+            f.write(spec)
+
+        def from_file(scan):
+            with open(path) as f:
+                scan(f)
+
+        memory = {
+            'regex': lambda: from_file(lambda f: drain(legacy_content_finder.finditer(f.read()))),
+            'tokenize': lambda: from_file(lambda f: drain(tokenize(f))),
+        }
+        for name, case in memory.items():
+            print(f'{name:>10}: {peak_memory(case) / 1024:.0f} KiB peak while scanning the file')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark markdown tokenizing')
+    parser.add_argument('--requirements', type=int, default=5000, help='number of requirements to generate')
+    parser.add_argument('--quote-lines', type=int, default=5, help='blockquote lines per requirement')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best one is reported')
+    parser.add_argument('--suite', action='store_true', help='time the hot paths and the CLI instead')
+    parser.add_argument('--depth', type=int, default=2, help='with --suite, levels of nested conditions')
+    parser.add_argument('--files', type=int, default=10, help='with --suite, markdown files the CLI parses')
+    parser.add_argument('--output', help='with --suite, store the results as json in this file')
+    parser.add_argument('--compare', help='with --suite, compare against the results stored in this file')
+    args = parser.parse_args()
+    if not args.suite:
+        main(args.requirements, args.quote_lines, args.repeat)
+        sys.exit()
+
+    parameters = {key: getattr(args, key) for key in ('requirements', 'quote_lines', 'depth', 'files', 'repeat')}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous['parameters'] != parameters:
+            print(f'{args.compare} was recorded with other parameters: {previous["parameters"]}', file=sys.stderr)
+        baseline = previous['results']
+
+    results = suite(args.requirements, args.quote_lines, args.depth, args.files, args.repeat)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'tool': 'specification_parser',
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'parameters': parameters,
+                'results': results,
+            }, f, indent=4)
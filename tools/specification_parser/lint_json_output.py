@@ -1,6 +1,8 @@
 from os.path import curdir, abspath, realpath, join, splitext, commonpath
 from os import walk
+from collections import defaultdict, namedtuple
 import json
+import re
 import sys
 
 
@@ -14,34 +16,158 @@ def _safe_path(f):
     return target
 
 
-def main(f):
+RFC_2119_KEYWORDS = {
+    "MUST", "REQUIRED", "SHALL", "MUST NOT", "SHALL NOT", "SHOULD", "RECOMMENDED",
+    "SHOULD NOT", "NOT RECOMMENDED", "MAY", "OPTIONAL",
+}
+
+LintDiagnostic = namedtuple('LintDiagnostic', ['check', 'severity', 'rule', 'message'])
+
+_number_finder = re.compile(r'(\d+(?:\.\d+)*)\s*$')
+
+
+class RuleIndex:
+    """
+    What the checks look at, gathered in a single walk over the whole rule tree.
+
+    `entries` holds (rule, parent, number) in document order, where number is the tuple of
+    integers the rule id ends in (None if it has none) and parent is None at the top level.
+    `ids` maps every rule id to the machine ids of the rules using it, and `machine_ids` every
+    machine id to the rule ids using it, both in document order.
+    `siblings` maps every number prefix to the last parts seen below it, counting the
+    prefixes of deeper numbers too, so 1.1.2.1 alone makes 1.1.2 exist.
+    """
+    __slots__ = ('entries', 'ids', 'machine_ids', 'siblings')
+
+    def __init__(self, rules):
+        self.entries = []
+        self.ids = defaultdict(list)
+        self.machine_ids = defaultdict(list)
+        self.siblings = defaultdict(set)
+
+        stack = [(rule, None) for rule in reversed(rules)]
+        while stack:
+            rule, parent = stack.pop()
+            match = _number_finder.search(rule['id'])
+            number = tuple(int(part) for part in match.group(1).split('.')) if match else None
+            self.entries.append((rule, parent, number))
+            self.ids[rule['id']].append(rule['machine_id'])
+            self.machine_ids[rule['machine_id']].append(rule['id'])
+            if number:
+                for i, part in enumerate(number):
+                    self.siblings[number[:i]].add(part)
+            stack.extend((child, (rule, number)) for child in reversed(rule.get('children', [])))
+
+
+CHECKS = {}
+
+def check(name, severity='error'):
+    'Registers the decorated function, which yields (rule, message) pairs for a RuleIndex, as a lint check'
+    def register(f):
+        CHECKS[name] = (severity, f)
+        return f
+    return register
+
+
+@check('duplicate-id')
+def duplicate_ids(index):
+    # one diagnostic per duplicated rule, at its first id: ids only count when their machine ids aren't duplicated already
+    for machine_id, ids in index.machine_ids.items():
+        if len(ids) > 1:
+            yield ids[0], (f"machine id {machine_id} is used by {len(ids)} rules ({', '.join(ids)}), "
+                           "which claim to be the same rule number")
+    for rule_id, machine_ids in index.ids.items():
+        if len(machine_ids) > 1 and all(len(index.machine_ids[machine_id]) == 1 for machine_id in machine_ids):
+            yield rule_id, f"id is used by {len(machine_ids)} rules, which claim to be the same rule number"
+
+
+@check('missing-keyword')
+def missing_keywords(index):
+    for rule, _, _ in index.entries:
+        if rule.get('RFC 2119 keyword') is None and 'requirement' in rule['id'].lower():
+            yield rule['id'], "is missing a RFC 2119 keyword"
+
+
+@check('conflicting-keyword')
+def conflicting_keywords(index):
+    for rule, _, _ in index.entries:
+        keyword = rule.get('RFC 2119 keyword')
+        if keyword is None:
+            continue
+        if keyword not in RFC_2119_KEYWORDS:
+            yield rule['id'], f"has {keyword!r} as its keyword, which is not a RFC 2119 keyword"
+        elif keyword not in rule['content']:
+            yield rule['id'], f"has {keyword} as its keyword, but its text doesn't say {keyword}"
+
+
+@check('numbering-gap', 'warning')
+def numbering_gaps(index):
+    for prefix, parts in sorted(index.siblings.items()):
+        missing = set(range(1, max(parts) + 1)) - parts
+        if missing:
+            section = '.'.join(map(str, prefix)) or 'top level'
+            numbers = ', '.join('.'.join(map(str, prefix + (part,))) for part in sorted(missing))
+            yield section, f"skips {numbers}"
+
+
+@check('parent-number-mismatch', 'warning')
+def parent_number_mismatches(index):
+    for rule, parent, number in index.entries:
+        if parent is None or number is None or parent[1] is None:
+            continue
+        parent_rule, parent_number = parent
+        if number[:len(parent_number)] != parent_number or len(number) <= len(parent_number):
+            yield rule['id'], f"is nested below {parent_rule['id']}, but isn't numbered below it"
+
+
+def run_checks(spec, checks=None):
+    'Runs the `checks` (by name, all of them by default) over the specification and returns their diagnostics'
+    index = RuleIndex(spec['rules'])
+    diagnostics = []
+    for name in checks or CHECKS:
+        severity, f = CHECKS[name]
+        diagnostics.extend(LintDiagnostic(name, severity, rule, message) for rule, message in f(index))
+    return diagnostics
+
+
+def lint(spec, name='specification.json', checks=None, output_format='text'):
+    """
+    Prints the problems in the parsed specification `spec` and returns how many errors there were.
+
+    The 'text' format prints them to stderr; 'json' prints a list of diagnostic objects to stdout.
+    """
+    try:
+        diagnostics = run_checks(spec, checks)
+    except (KeyError, TypeError, AttributeError):
+        print(f"Non json-spec formatted file found: {name}", file=sys.stderr)
+        return 1
+
+    if output_format == 'json':
+        print(json.dumps([dict(d._asdict(), file=name) for d in diagnostics], indent=4))
+    else:
+        for d in diagnostics:
+            print(f"{name}: {d.severity}: Rule {d.rule} {d.message} [{d.check}]", file=sys.stderr)
+    return sum(1 for d in diagnostics if d.severity == 'error')
+
+
+def main(f, checks=None, output_format='text'):
     f = _safe_path(f)
-    errors = 0
     with open(f) as jsonfile:
         spec = json.load(jsonfile)
-        entries = [];
-        machineid_seen = []
-        for entry in spec['rules']:
-            machineid_seen += [entry['machine_id']]
-            entries.append(entry)
-            for child in entry.get('children', []):
-                entries.append(child)
-
-        if len(machineid_seen) != len(set(machineid_seen)):
-            duped = set([x for x in machineid_seen if machineid_seen.count(x) > 1])
-            print(f"There were duplicated machine ids in the list. This means two things claim to be the same rule number. Duplicated thing: {duped}", file=sys.stderr)
-
-        try:
-            for entry in entries:
-                if entry.get('RFC 2119 keyword') is None and \
-                   'requirement' in entry['id'].lower():
-                    print(f"{jsonfile.name}: Rule {entry['id']} is missing a RFC 2119 keyword", file=sys.stderr)
-                    errors += 1
-                pass
-        except Exception as k:
-            print(f"Non json-spec formatted file found: {jsonfile.name}", file=sys.stderr)
+        errors = lint(spec, jsonfile.name, checks, output_format)
 
     sys.exit(errors)
 
 if __name__ == '__main__':
-    main(sys.argv[1])
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Checks a generated specification.json for problems')
+    arg_parser.add_argument('file', help='the specification.json to check')
+    arg_parser.add_argument('--checks', help='comma separated checks to run, out of: %s (default: all)' % ', '.join(CHECKS))
+    arg_parser.add_argument('--format', choices=('text', 'json'), default='text', help='print diagnostics as text to stderr or as json to stdout')
+    args = arg_parser.parse_args()
+
+    checks = [c for c in args.checks.split(',') if c] if args.checks else None
+    if checks and set(checks) - set(CHECKS):
+        arg_parser.error(f"unknown checks: {', '.join(sorted(set(checks) - set(CHECKS)))}")
+    main(args.file, checks, args.format)
@@ -1,8 +1,14 @@
 import re
-import glob
 import json
-from os.path import curdir, abspath, join, splitext, isfile
-from os import walk
+import hashlib
+import sys
+import cProfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter, sleep
+from os.path import curdir, abspath, join, splitext, isfile, relpath, sep
+from os import walk, stat, cpu_count, getpid, replace, unlink
 
 rfc_2119_keywords_regexes = [
     r"MUST",
@@ -18,6 +24,65 @@ rfc_2119_keywords_regexes = [
     r"OPTIONAL",
 ]
 
+# A single alternation of all keywords, longest first, so `**MUST NOT**` is never read as `MUST`.
+rfc_2119_keyword_finder = re.compile(
+    r"\*\*(%s)\*\*" % "|".join(sorted(rfc_2119_keywords_regexes, key=len, reverse=True))
+)
+
+# What --timings gathers: the seconds spent per phase, and per parsed file its size and headline
+# matches. None while not instrumented, which keeps phase() and parse() free of any bookkeeping.
+_timings = None
+
+@contextmanager
+def phase(name):
+    'Adds the wall time of the block to the phase `name` of --timings'
+    if _timings is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        _timings['phases'][name] = _timings['phases'].get(name, 0.0) + perf_counter() - started
+
+def timings_summary(timings, slowest=5):
+    lines = [f'{name:>12}: {seconds:.3f}s' for name, seconds in timings['phases'].items()]
+    bytes_read = sum(f['bytes_read'] for f in timings['files'])
+    matches = sum(f['matches'] for f in timings['files'])
+    lines.append(f"{len(timings['files'])} files parsed, {bytes_read} bytes read, {matches} headline matches")
+    for f in sorted(timings['files'], key=lambda f: f['seconds'], reverse=True)[:slowest]:
+        lines.append(f"  {f['seconds']:.4f}s {f['path']}")
+    return '\n'.join(lines)
+
+@contextmanager
+def instrumented(timings_path=None, profile_path=None):
+    """
+    Instruments the block for --timings and --profile, even when it ends in sys.exit().
+
+    With a `timings_path`, a summary is printed to stderr and, unless the path is `-`, the timings
+    are stored there as json. With a `profile_path`, cProfile stats are dumped there for pstats.
+    Files parsed in worker processes (--jobs) are not timed.
+    """
+    global _timings
+    profiler = cProfile.Profile() if profile_path else None
+    if timings_path:
+        _timings = {'phases': {}, 'files': []}
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if timings_path:
+            timings, _timings = _timings, None
+            print(timings_summary(timings), file=sys.stderr)
+            if timings_path != '-':
+                with open(timings_path, 'w') as f:
+                    json.dump(timings, f, indent=4)
+
+
 def get_ignored_path_globs(root):
     fileName = join(root, ".specignore")
     if not isfile(fileName):
@@ -35,41 +100,85 @@ def get_ignored_path_globs(root):
 
         return globs
 
-def get_ignored_paths(root):
-    globs = get_ignored_path_globs(root)
-    globbed_paths = set()
-    ignored_files = set()
-
-    for g in globs:
-        globbed_paths.update(glob.glob(g, recursive=True))
-
-    for p in globbed_paths:
-        if isfile(p):
-            ignored_files.add(join(root, p))
+def _compile_ignore_pattern(pattern):
+    'Returns (regex, negated, directories only) for a gitignore-style pattern'
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+    if pattern.startswith('./'):
+        pattern = pattern[2:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    # a pattern with a slash is relative to the root, one without matches at any depth
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    regex = [] if anchored else ['(?:.*/)?']
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            regex.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            chars = pattern[i + 1:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex.append('[%s]' % chars.replace('\\', '\\\\'))
+            i = end + 1
         else:
-            ignored_files.update(glob.glob(join(root, p, "**/*.md"), recursive=True))
-
-    return ignored_files
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(''.join(regex) + r'\Z'), negated, dir_only
+
+class SpecIgnore:
+    """
+    The patterns of a .specignore file, matched like a .gitignore against '/'-separated paths
+    relative to the root: `*` and `?` stay within a path segment, `**` spans segments, a trailing
+    `/` only matches directories, `!` re-includes, and the last matching pattern wins.
+
+    Ignoring a directory ignores everything below it, so find_markdown_file_paths() never walks into it.
+    """
+    __slots__ = ('rules',)
+
+    def __init__(self, patterns):
+        self.rules = [_compile_ignore_pattern(p) for p in patterns]
+
+    def ignores(self, path, is_dir=False):
+        for regex, negated, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                return not negated
+        return False
 
 def find_markdown_file_paths(root):
-    'Finds the .md files in the root provided.'
+    'Finds the .md files in the root provided, skipping what its .specignore ignores.'
     markdown_file_paths = []
-    ignored_paths = get_ignored_paths(root)
+    spec_ignore = SpecIgnore(get_ignored_path_globs(root))
 
-    for root_path, _, file_paths, in walk(root):
-        for file_path in file_paths:
-
-            absolute_file_path = join(root_path, file_path)
+    for root_path, dir_names, file_paths, in walk(root):
+        relative_root = relpath(root_path, root).replace(sep, '/')
+        prefix = '' if relative_root == '.' else relative_root + '/'
+        # pruned in place, so walk() doesn't descend into ignored directories
+        dir_names[:] = [d for d in dir_names if not spec_ignore.ignores(prefix + d, is_dir=True)]
 
-            if absolute_file_path in ignored_paths:
+        for file_path in file_paths:
+            if splitext(file_path)[1] != ".md" or spec_ignore.ignores(prefix + file_path):
                 continue
+            markdown_file_paths.append(join(root_path, file_path))
 
-            _, file_extension = splitext(absolute_file_path)
-
-            if file_extension == ".md":
-                markdown_file_paths.append(absolute_file_path)
-
-    return markdown_file_paths
+    # walk order depends on the file system; sort so the generated output is reproducible
+    return sorted(markdown_file_paths)
 
 
 def clean_content(content):
@@ -77,131 +186,534 @@ def clean_content(content):
     lines = content.splitlines()
     content = '\n'.join([x for x in lines if x.strip() != '' and x.strip().startswith('>')])
 
-    for rfc_2119_keyword_regex in rfc_2119_keywords_regexes:
-        content = re.sub(
-            f"\\*\\*{rfc_2119_keyword_regex}\\*\\*",
-            rfc_2119_keyword_regex,
-            content
-        )
+    content = rfc_2119_keyword_finder.sub(r"\1", content)
     return re.sub(r"\n?>\s*", " ", content.strip()).strip()
 
 
-def find_rfc_2119_keyword(content):
-    'Returns the RFC2119 keyword, if present'
-    for rfc_2119_keyword_regex in rfc_2119_keywords_regexes:
-
-        if re.search(
-            f"\\*\\*{rfc_2119_keyword_regex}\\*\\*", content
-        ) is not None:
-            return rfc_2119_keyword_regex
+def find_rfc_2119_keywords(content):
+    'Returns every bolded RFC2119 keyword in the content, in order of appearance'
+    return rfc_2119_keyword_finder.findall(content)
 
-def parsed_content_to_hierarchy(parsed_content):
-    'Turns a bunch of headline & content pairings into a tree of requirements'
-    content_tree = []
-    headline_stack = []
 
-    node = lambda l,h,c: {'level': l, 'headline': h, 'content': c, 'children': []}
+def find_rfc_2119_keyword(content):
+    'Returns the first RFC2119 keyword in the content, if present'
+    match = rfc_2119_keyword_finder.search(content)
+    if match is not None:
+        return match.group(1)
+
+# A structural problem found while building the headline tree, e.g. a skipped headline level.
+Diagnostic = namedtuple('Diagnostic', ['kind', 'headline', 'message', 'path'], defaults=[None])
+
+class HeadlineNode:
+    'A markdown headline, its blockquote and the headlines nested below it'
+    __slots__ = ('level', 'headline', 'content', 'children')
+
+    def __init__(self, level, headline, content):
+        self.level = level
+        self.headline = headline
+        self.content = content
+        self.children = []
+
+    def __getitem__(self, key):
+        # lets nodes stand in for the plain dicts gen_node() has always accepted
+        return getattr(self, key)
+
+def build_headline_tree(parsed_content):
+    """
+    Nests headline & content pairings by headline level, returning (root, diagnostics).
+
+    The root is an empty level 0 node. A headline closes every open headline at its own
+    level or deeper, however many levels that is.
+    """
+    root = HeadlineNode('', '', '')
+    stack = [root]
+    diagnostics = []
 
     for level, headline, content in parsed_content:
-        try:
-            if len(headline_stack) == 0: # top-most node
-                cur = node(level, headline, content)
-                content_tree.append(cur)
-                headline_stack.insert(0, [level, headline, cur])
-            elif len(headline_stack[0][0]) >= len(level): # Sibling or parent node
-                if len(headline_stack[0][0]) > len(level): # parent, right?
-                    headline_stack.pop(0)
-                headline_stack.pop(0)
-                if len(headline_stack) == 0:
-                    parent = content_tree
-                else:
-                    parent = headline_stack[0][2]['children']
-                cur = node(level, headline, content)
-                parent.append(cur)
-                headline_stack.insert(0, [level, headline, cur])
-            elif len(level) > len(headline_stack[0][0]): # child node
-                # TODO: emit warning if headlines are too deep
-                cur = node(level, headline, content)
-                parent = headline_stack[0][2]
-                parent['children'].append(cur)
-                headline_stack.insert(0, [level, headline, cur])
-            else:
-                headline_stack.pop(0)
-        except Exception as k:
-            print(k);
-
-    # Specify a root so we know that everything is a node all the way down.
-    root = node(0, '', '')
-    root['children'] = content_tree
+        while len(stack) > 1 and len(stack[-1].level) >= len(level):
+            stack.pop()
+
+        parent = stack[-1]
+        if parent is not root and len(level) > len(parent.level) + 1:
+            diagnostics.append(Diagnostic(
+                'skipped-level', headline,
+                f'is {len(level) - len(parent.level)} levels below its parent{parent.headline}'))
+
+        cur = HeadlineNode(level, headline, content)
+        parent.children.append(cur)
+        stack.append(cur)
+
+    diagnostics.extend(_condition_diagnostics(root))
+    return root, diagnostics
+
+def _condition_diagnostics(parent):
+    'Reports conditional requirements that are not nested below a condition'
+    for node in parent.children:
+        if 'conditional requirement' in node.headline.lower() and 'condition' not in parent.headline.lower():
+            yield Diagnostic('orphan-conditional-requirement', node.headline, 'is not nested below a condition')
+        yield from _condition_diagnostics(node)
+
+def parsed_content_to_hierarchy(parsed_content, diagnostics=None):
+    """
+    Turns a bunch of headline & content pairings into a tree of requirements.
+
+    Structural problems are appended to `diagnostics`, if given.
+    """
+    root, found = build_headline_tree(parsed_content)
+    if diagnostics is not None:
+        diagnostics.extend(found)
     return content_tree_to_spec(root)
 
+class RequirementNode:
+    'A requirement or condition of the specification, with the requirements nested below it'
+    __slots__ = ('id', 'machine_id', 'keyword', 'content', 'children')
+
+    def __init__(self, id, machine_id, keyword, content, children=None):
+        self.id = id
+        self.machine_id = machine_id
+        self.keyword = keyword
+        self.content = content
+        self.children = [] if children is None else children
+
+    def __eq__(self, other):
+        if not isinstance(other, RequirementNode):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __repr__(self):
+        return f'RequirementNode({self.id!r}, children={self.children!r})'
+
+    def to_json(self):
+        'Returns the node as it appears in specification.json'
+        return {
+            'id': self.id,
+            'machine_id': self.machine_id,
+            'content': self.content,
+            'RFC 2119 keyword': self.keyword,
+            'children': [child.to_json() for child in self.children],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data['id'],
+            data['machine_id'],
+            data['RFC 2119 keyword'],
+            data['content'],
+            [cls.from_json(child) for child in data['children']],
+        )
+
 def gen_node(ct):
     'given a content node, turn it into a requirements node'
     headline = ct['headline']
     content = ct['content']
-    keyword = find_rfc_2119_keyword(content)
 
     req_group = re.search(r'(?P<req>(requirement|condition)[^\n]+)', headline, re.IGNORECASE)
     if req_group is None:
         return None
 
     _id = req_group.groups()[0]
-    return {
-        'id': _id,
-        'machine_id': re.sub(r"[^\w]", "_", _id.lower()),
-        'content': clean_content(content),
-        'RFC 2119 keyword': keyword,
-        'children': [],
-    }
+    return RequirementNode(
+        _id,
+        re.sub(r"[^\w]", "_", _id.lower()),
+        find_rfc_2119_keyword(content),
+        clean_content(content),
+    )
+
+def _append_requirements(ct, requirements):
+    """
+    Appends the requirement nodes for the children of `ct` to `requirements`.
+
+    Headlines that are not requirements are skipped, and their own requirements are
+    appended in their place.
+    """
+    for child in ct['children']:
+        node = gen_node(child)
+        if node is None:
+            _append_requirements(child, requirements)
+        else:
+            requirements.append(node)
+            _append_requirements(child, node.children)
 
 def content_tree_to_spec(ct):
+    'Returns the requirement node for `ct`, or the list of requirements below it (None if empty)'
     current = gen_node(ct)
-    children_grouped = [content_tree_to_spec(x) for x in ct['children']]
-    # Filter out potential None entries.
+    if current is not None:
+        _append_requirements(ct, current.children)
+        return current
+
     children = []
-    for _iter in children_grouped:
-        '''
-        So we might get a None (skip it), an object (add it to the list) or another list (merge it with list).
-        '''
-        if _iter is None:
+    _append_requirements(ct, children)
+    return children or None
+
+
+headline_finder = re.compile(r'(?P<level>####+)(?P<headline>.+)')
+
+def tokenize(lines):
+    """
+    Yields a (level, headline, blockquote) tuple for every level 4+ headline followed by a
+    blockquote. At most one other line (e.g. a status badge) may sit between the two.
+
+    Lines are consumed one at a time, so only the blockquote being collected is held in memory.
+    """
+    level = headline = None
+    preamble_lines = 0
+    blockquote = []
+
+    for line in lines:
+        stripped = line.strip()
+        if blockquote:
+            if stripped.startswith('>'):
+                blockquote.append(line)
+                continue
+            yield level, headline, ''.join(blockquote)
+            level = headline = None
+            blockquote = []
+
+        match = headline_finder.match(line.rstrip('\r\n')) if line.startswith('####') else None
+        if match is not None:
+            level, headline = match.group('level'), match.group('headline')
+            preamble_lines = 0
+        elif headline is None or stripped == '':
             continue
-        if type(_iter) == list:
-            children.extend(_iter)
+        elif stripped.startswith('>'):
+            blockquote.append(line)
+        elif preamble_lines == 0:
+            preamble_lines += 1
         else:
-            children.append(_iter)
+            # too much other content came first, so this headline has no requirement text
+            level = headline = None
 
-    if current is None:
-        if len(children) > 0:
-            return children
-        return
+    if blockquote:
+        yield level, headline, ''.join(blockquote)
+
+def parse(markdown_file_path, diagnostics=None):
+    started = perf_counter()
+    found = []
+    with open(markdown_file_path, "r") as markdown_file:
+        tokens = tokenize(markdown_file)
+        if _timings is not None:
+            # materialized to count the headline matches, only while instrumented
+            tokens = list(tokens)
+        rules = parsed_content_to_hierarchy(tokens, found)
+    if _timings is not None:
+        _timings['files'].append({
+            'path': markdown_file_path,
+            'seconds': perf_counter() - started,
+            'bytes_read': stat(markdown_file_path).st_size,
+            'matches': len(tokens),
+        })
+    if diagnostics is not None:
+        diagnostics.extend(d._replace(path=markdown_file_path) for d in found)
+    return rules
+
+def _parse_with_diagnostics(markdown_file_path):
+    'Parses a file into its rules and the diagnostics as stored in a cache entry'
+    diagnostics = []
+    rules = parse(markdown_file_path, diagnostics)
+    return rules, [list(d[:3]) for d in diagnostics]
+
+def _rules_to_json(rules):
+    return [rule.to_json() for rule in rules] if rules else rules
+
+def _rules_from_json(rules):
+    return [RequirementNode.from_json(rule) for rule in rules] if rules else rules
+
+# Bump whenever the layout of the parse cache changes.
+PARSE_CACHE_VERSION = 2
+
+def _parser_fingerprint():
+    'Hash of this module, so cached trees are thrown away whenever the parser itself changes'
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_parse_cache(cache_path):
+    'Loads the on-disk parse cache, or an empty one if it is missing, unreadable or stale'
+    fingerprint = _parser_fingerprint()
+    empty = {'version': PARSE_CACHE_VERSION, 'parser': fingerprint, 'files': {}}
+    if not isfile(cache_path):
+        return empty
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if not isinstance(cache, dict) or \
+       cache.get('version') != PARSE_CACHE_VERSION or \
+       cache.get('parser') != fingerprint:
+        return empty
+    return cache
+
+def save_parse_cache(cache_path, cache):
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f)
+
+def _cache_entry(markdown_file_path, cache, root):
+    """
+    Returns the cache key and a fresh entry for the file.
+
+    A matching size and mtime is trusted as-is; otherwise the content hash decides whether the
+    cached rules are still valid. The entry only carries 'rules' when the file is unchanged.
+    """
+    key = relpath(markdown_file_path, root)
+    file_stat = stat(markdown_file_path)
+    cached = cache['files'].get(key)
+    if cached is not None and \
+       cached['size'] == file_stat.st_size and \
+       cached['mtime_ns'] == file_stat.st_mtime_ns:
+        return key, cached
+
+    with open(markdown_file_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    entry = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'sha256': digest}
+    if cached is not None and cached['sha256'] == digest:
+        entry['rules'] = cached['rules']
+        entry['diagnostics'] = cached['diagnostics']
+    return key, entry
+
+def parse_cached(markdown_file_path, cache, root=curdir, diagnostics=None):
+    'Like parse(), but reuses the requirement tree stored in `cache` when the file is unchanged.'
+    return parse_all([markdown_file_path], cache, root, diagnostics=diagnostics, prune=False)[0]
+
+def parse_all(markdown_file_paths, cache=None, root=curdir, jobs=1, diagnostics=None, prune=True):
+    """
+    Parses every file and returns the results in the order of `markdown_file_paths`.
+
+    Files that are not served from `cache` are parsed in a pool of `jobs` processes. Unless
+    `prune` is off, the cache is left holding exactly the entries for `markdown_file_paths`.
+    """
+    entries = []
+    for markdown_file_path in markdown_file_paths:
+        if cache is None:
+            entries.append((None, {}))
+        else:
+            entries.append(_cache_entry(markdown_file_path, cache, root))
+
+    dirty = [p for p, (_, entry) in zip(markdown_file_paths, entries) if 'rules' not in entry]
+    if jobs > 1 and len(dirty) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            parsed = dict(zip(dirty, executor.map(_parse_with_diagnostics, dirty)))
     else:
-        current['children'] = children
-        return current
+        parsed = {p: _parse_with_diagnostics(p) for p in dirty}
+
+    results = []
+    files = {}
+    if cache is not None and not prune:
+        files.update(cache['files'])
+    for markdown_file_path, (key, entry) in zip(markdown_file_paths, entries):
+        if 'rules' in entry:
+            rules = _rules_from_json(entry['rules'])
+        else:
+            rules, entry['diagnostics'] = parsed[markdown_file_path]
+            if cache is not None:
+                entry['rules'] = _rules_to_json(rules)
+        files[key] = entry
+        results.append(rules)
+        if diagnostics is not None:
+            diagnostics.extend(Diagnostic(*d, path=markdown_file_path) for d in entry['diagnostics'])
+
+    if cache is not None:
+        cache['files'] = files
+    return results
+
+OUTPUT_FORMATS = ('pretty', 'compact', 'jsonl')
+
+def iter_json_rules(rules, output_format='pretty', key='rules'):
+    """
+    Yields `rules` as json text a rule at a time, so the whole document is never held in memory.
+
+    'pretty' is exactly what json.dump(..., indent=4) writes and 'compact' leaves out all
+    whitespace, both for {key: [rules]}, or for the bare list without a `key`. 'jsonl' writes
+    one compact rule per line instead, for consumers that read rules as they come.
+    """
+    if output_format == 'jsonl':
+        for rule in rules:
+            yield json.dumps(rule.to_json(), separators=(',', ':')) + '\n'
+        return
 
+    pretty = output_format == 'pretty'
+    depth = 1 if key is None else 2
+    if key is None:
+        yield '['
+    else:
+        yield ('{\n    %s: [' if pretty else '{%s:[') % json.dumps(key)
 
-def parse(markdown_file_path):
-    with open(markdown_file_path, "r") as markdown_file:
-        content_finder = re.compile(r'^(?P<level>####+)(?P<headline>[^\n]+)\n+?.*?\n+?(?P<rest>>\s[^#?]*)', re.MULTILINE)
-        parsed = content_finder.findall(markdown_file.read())
-        return parsed_content_to_hierarchy(parsed)
+    separator = ''
+    for rule in rules:
+        if pretty:
+            padding = '\n' + '    ' * depth
+            yield separator + padding + json.dumps(rule.to_json(), indent=4).replace('\n', padding)
+        else:
+            yield separator + json.dumps(rule.to_json(), separators=(',', ':'))
+        separator = ','
+
+    if pretty and separator:
+        yield '\n' + '    ' * (depth - 1)
+    yield ']'
+    if key is not None:
+        yield '\n}' if pretty else '}'
+
+def write_atomically(path, chunks):
+    'Writes the chunks next to `path` first and then moves them over it, so readers never see half a file'
+    temporary_path = f'{path}.{getpid()}.tmp'
+    try:
+        with open(temporary_path, 'w') as f:
+            f.writelines(chunks)
+        replace(temporary_path, path)
+    except BaseException:
+        if isfile(temporary_path):
+            unlink(temporary_path)
+        raise
+
+def write_specification(path, rules, output_format='pretty'):
+    'Writes the rules to `path` as specification.json, see iter_json_rules() for the formats'
+    write_atomically(path, iter_json_rules(rules, output_format))
+
+def rule_sort_key(rule):
+    'Orders rules by their number, e.g. Requirement 1.2.10 after Condition 1.2.9'
+    return [int(x) for x in rule.id.split(' ')[-1].split('.')]
+
+class SpecWatcher:
+    """
+    Keeps the parsed rules of every markdown file below `root` in memory, for --watch.
+
+    Every poll() walks the tree again but only re-parses the files whose size or mtime changed.
+    Files that can't be read or parsed keep their previous rules until they are saved again, and
+    what went wrong is in `errors` until the next poll().
+    """
+    __slots__ = ('root', 'files', 'errors')
+
+    def __init__(self, root):
+        self.root = root
+        # path -> ((size, mtime_ns), rules, diagnostics)
+        self.files = {}
+        self.errors = []
+
+    def poll(self):
+        'Parses new and changed files, forgets deleted ones, and returns the paths of all of them'
+        changed = []
+        files = {}
+        self.errors = []
+        for markdown_file_path in find_markdown_file_paths(self.root):
+            try:
+                file_stat = stat(markdown_file_path)
+                signature = (file_stat.st_size, file_stat.st_mtime_ns)
+                known = self.files.get(markdown_file_path)
+                if known is None or known[0] != signature:
+                    diagnostics = []
+                    try:
+                        rules = parse(markdown_file_path, diagnostics) or []
+                    except FileNotFoundError:
+                        raise
+                    except Exception as e:
+                        # a half-saved file, most likely; the next save gets another go
+                        self.errors.append(f'{relpath(markdown_file_path, self.root)}: {e!r}')
+                        rules, diagnostics = (known[1] if known else []), []
+                    known = (signature, rules, diagnostics)
+                    changed.append(markdown_file_path)
+            except FileNotFoundError:
+                # deleted since the walk; the next poll won't see it either
+                continue
+            files[markdown_file_path] = known
+        changed.extend(p for p in self.files if p not in files)
+        self.files = files
+        return changed
+
+    def diagnostics(self, markdown_file_paths):
+        return [d for p in markdown_file_paths if p in self.files for d in self.files[p][2]]
+
+    def rules(self):
+        'Every rule, sorted as in specification.json'
+        return sorted((rule for _, rules, _ in self.files.values() for rule in rules), key=rule_sort_key)
+
+def watch(root, output, output_format='pretty', interval=0.5, lint=None):
+    """
+    Rewrites `output` whenever a markdown file below `root` changes, until interrupted.
+
+    The tree is polled every `interval` seconds and only changed files are re-parsed. With a `lint`
+    function, it is called with the specification after every write. Errors are printed rather than
+    ending the watch, so saving the file again recovers.
+    """
+    watcher = SpecWatcher(root)
+    while True:
+        started = perf_counter()
+        try:
+            changed = watcher.poll()
+            for error in watcher.errors:
+                print(f'Could not parse {error}', file=sys.stderr)
+            if changed:
+                for d in watcher.diagnostics(changed):
+                    print(f"{relpath(d.path, root)}: {d.headline.strip()} {d.message} [{d.kind}]", file=sys.stderr)
+                rules = watcher.rules()
+                write_specification(output, rules, output_format)
+                names = ', '.join(relpath(p, root) for p in changed[:3]) + (', ...' if len(changed) > 3 else '')
+                print(f'Wrote {output} in {(perf_counter() - started) * 1000:.0f} ms after changes to {names}', file=sys.stderr)
+                if lint is not None:
+                    lint({'rules': [rule.to_json() for rule in rules]}, output)
+        except Exception as e:
+            print(f'Could not update {output}: {e!r}', file=sys.stderr)
+        sleep(interval)
 
 def write_json_specifications(requirements):
     for md_absolute_file_path, requirement_sections in requirements.items():
-        with open(
-            "".join([splitext(md_absolute_file_path)[0], ".json"]), "w"
-        ) as json_file:
-            json_file.write(json.dumps(requirement_sections, indent=4))
+        path = "".join([splitext(md_absolute_file_path)[0], ".json"])
+        if requirement_sections:
+            write_atomically(path, iter_json_rules(requirement_sections, key=None))
+        else:
+            write_atomically(path, [json.dumps(requirement_sections)])
 
 
 if __name__ == "__main__":
-    combined = {"rules": []}
-    for markdown_file_path in find_markdown_file_paths(
-        join(abspath(curdir))
-    ):
-        result = parse(markdown_file_path)
-        if result:
-            combined['rules'].extend(result)
-
-    combined['rules'] = sorted(combined['rules'], key=lambda x: [int(x) for x in x['id'].split(' ')[-1].split('.')])
-    with open('./specification.json', 'w') as f:
-        json.dump(combined, f, indent=4)
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Generates specification.json from the markdown specification')
+    arg_parser.add_argument('--cache-file', action='store', help='reuse parsed requirements of unchanged markdown files, stored in this file')
+    arg_parser.add_argument('--jobs', action='store', type=int, default=1, help='number of processes to parse with, 0 for one per CPU')
+    arg_parser.add_argument('--format', choices=OUTPUT_FORMATS, default='pretty', help='pretty printed json (the default), compact json, or json lines with one rule per line')
+    arg_parser.add_argument('--output', default='./specification.json', help='where to write the rules, ./specification.json by default')
+    arg_parser.add_argument('--watch', action='store_true', help='keep running and rewrite the output whenever a markdown file changes')
+    arg_parser.add_argument('--interval', type=float, default=0.5, help='with --watch, seconds between checks for changes')
+    arg_parser.add_argument('--lint', action='store_true', help='with --watch, lint the specification after every change')
+    arg_parser.add_argument('--timings', nargs='?', const='-', metavar='FILE', help='print where the time went to stderr, and store it as json in FILE if given')
+    arg_parser.add_argument('--profile', metavar='FILE', help='store cProfile stats of the run in FILE')
+    args = arg_parser.parse_args()
+
+    root = join(abspath(curdir))
+    jobs = args.jobs or cpu_count() or 1
+
+    if args.watch:
+        lint = None
+        if args.lint:
+            from lint_json_output import lint
+        try:
+            watch(root, args.output, args.format, args.interval, lint)
+        except KeyboardInterrupt:
+            sys.exit()
+
+    with instrumented(args.timings, args.profile):
+        cache = None
+        if args.cache_file:
+            with phase('load cache'):
+                cache = load_parse_cache(args.cache_file)
+
+        with phase('walk'):
+            markdown_file_paths = find_markdown_file_paths(root)
+
+        combined = {"rules": []}
+        diagnostics = []
+        with phase('parse'):
+            for result in parse_all(markdown_file_paths, cache, root, jobs, diagnostics):
+                if result:
+                    combined['rules'].extend(result)
+
+        for d in diagnostics:
+            print(f"{relpath(d.path, root)}: {d.headline.strip()} {d.message} [{d.kind}]", file=sys.stderr)
+
+        if cache is not None:
+            with phase('save cache'):
+                save_parse_cache(args.cache_file, cache)
+
+        with phase('write json'):
+            rules = sorted(combined['rules'], key=rule_sort_key)
+            write_specification(args.output, rules, args.format)
@@ -1,14 +1,41 @@
 from unittest import TestCase, skip, main
-from os.path import abspath, curdir, join
+from os import chdir, getcwd, listdir, makedirs, remove
+from os.path import abspath, curdir, dirname, join
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stderr
+from io import StringIO
+from unittest.mock import patch
+import json
 import re
 
 from specification_parser import (
     find_markdown_file_paths,
     parse,
+    parse_cached,
+    parse_all,
+    load_parse_cache,
+    save_parse_cache,
     parsed_content_to_hierarchy,
-    gen_node
+    gen_node,
+    content_tree_to_spec,
+    RequirementNode,
+    tokenize,
+    build_headline_tree,
+    Diagnostic,
+    clean_content,
+    find_rfc_2119_keyword,
+    find_rfc_2119_keywords,
+    SpecIgnore,
+    SpecWatcher,
+    watch,
+    iter_json_rules,
+    write_specification,
+    instrumented,
+    phase,
 )
 
+from lint_json_output import run_checks
+
 
 content_finder = re.compile(r'\s*(?P<level>#+)(?P<headline>[^\n]+)(?P<rest>[^#]*)', re.MULTILINE)
 class NewerTestParser(TestCase):
@@ -108,3 +135,375 @@ class NewerTestParser(TestCase):
             'RFC 2119 keyword': None,
             'children': [],
         }, node)
+
+
+class TestParseCache(TestCase):
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_unchanged_file_is_served_from_cache(self):
+        with TemporaryDirectory() as root:
+            md = join(root, 'spec.md')
+            self.write(md, '#### Requirement 1.1\n\n> It **MUST** work.\n')
+            cache = load_parse_cache(join(root, 'cache.json'))
+
+            rules = parse_cached(md, cache, root)
+            self.assertEqual('Requirement 1.1', rules[0].id)
+            self.assertEqual([rules[0].to_json()], cache['files']['spec.md']['rules'])
+
+            # a second call must not re-parse, so a doctored entry is returned as-is
+            cache['files']['spec.md']['rules'][0]['id'] = 'from cache'
+            self.assertEqual('from cache', parse_cached(md, cache, root)[0].id)
+
+    def test_changed_file_is_reparsed(self):
+        with TemporaryDirectory() as root:
+            md = join(root, 'spec.md')
+            self.write(md, '#### Requirement 1.1\n\n> It **MUST** work.\n')
+            cache = load_parse_cache(join(root, 'cache.json'))
+            parse_cached(md, cache, root)
+
+            self.write(md, '#### Requirement 1.2\n\n> It **MAY** work, with more words.\n')
+            rules = parse_cached(md, cache, root)
+            self.assertEqual('Requirement 1.2', rules[0].id)
+            self.assertEqual('MAY', rules[0].keyword)
+
+    def test_cache_round_trips_and_rejects_foreign_files(self):
+        with TemporaryDirectory() as root:
+            cache_path = join(root, 'cache.json')
+            cache = load_parse_cache(cache_path)
+            cache['files']['spec.md'] = {'size': 1, 'mtime_ns': 1, 'sha256': 'x', 'rules': None}
+            save_parse_cache(cache_path, cache)
+            self.assertEqual(cache, load_parse_cache(cache_path))
+
+            self.write(cache_path, '{"version": -1, "files": {"spec.md": {}}}')
+            self.assertEqual({}, load_parse_cache(cache_path)['files'])
+
+
+class TestParseAll(TestCase):
+    def test_pool_matches_serial_order(self):
+        with TemporaryDirectory() as root:
+            paths = []
+            for i in range(1, 5):
+                path = join(root, f'{i}.md')
+                with open(path, 'w') as f:
+                    f.write(f'#### Requirement {i}.1\n\n> It **MUST** work.\n')
+                paths.append(path)
+
+            serial = parse_all(paths)
+            self.assertEqual(serial, parse_all(paths, jobs=2))
+            self.assertEqual(['Requirement 1.1', 'Requirement 2.1', 'Requirement 3.1', 'Requirement 4.1'],
+                             [rules[0].id for rules in serial])
+
+    def test_cache_only_keeps_given_files(self):
+        with TemporaryDirectory() as root:
+            path = join(root, 'spec.md')
+            with open(path, 'w') as f:
+                f.write('#### Requirement 1.1\n\n> It **MUST** work.\n')
+            cache = load_parse_cache(join(root, 'cache.json'))
+            cache['files']['deleted.md'] = {'size': 0, 'mtime_ns': 0, 'sha256': '', 'rules': None}
+
+            parse_all([path], cache, root, jobs=2)
+            self.assertEqual(['spec.md'], list(cache['files']))
+
+
+class TestRfc2119Keywords(TestCase):
+    def test_finds_every_keyword_in_order(self):
+        content = '> It **SHOULD NOT** block, and **MUST** return **NOT RECOMMENDED** values.'
+        self.assertEqual(['SHOULD NOT', 'MUST', 'NOT RECOMMENDED'], find_rfc_2119_keywords(content))
+
+    def test_first_keyword_wins_over_list_order(self):
+        self.assertEqual('MUST NOT', find_rfc_2119_keyword('It **MUST NOT** block, but **MUST** return.'))
+        self.assertEqual('SHOULD NOT', find_rfc_2119_keyword('It **SHOULD NOT** block, but **MUST** return.'))
+        self.assertIsNone(find_rfc_2119_keyword('It MUST be bold to count.'))
+
+    def test_clean_content_unbolds_keywords(self):
+        self.assertEqual('It MUST NOT block and MAY return.',
+                         clean_content('> It **MUST NOT** block\n> and **MAY** return.'))
+
+
+class TestTokenize(TestCase):
+    def test_keeps_blockquotes_with_hashes_and_question_marks(self):
+        content = [
+            '#### Requirement 1.1\n',
+            '\n',
+            '> Is it **REQUIRED**? See [this](#anchor).\n',
+            '> Yes.\n',
+            '\n',
+            'Prose that is not part of the requirement.\n',
+        ]
+        self.assertEqual([
+            ('####', ' Requirement 1.1', '> Is it **REQUIRED**? See [this](#anchor).\n> Yes.\n'),
+        ], list(tokenize(content)))
+
+    def test_allows_one_line_before_the_blockquote(self):
+        content = '#### Condition 1.2\n\n[![hardening](badge)](link)\n\n> The condition.\n'
+        self.assertEqual([('####', ' Condition 1.2', '> The condition.\n')],
+                         list(tokenize(content.splitlines(keepends=True))))
+
+    def test_skips_headlines_without_blockquotes(self):
+        content = [
+            '#### Requirement 1.1\n', 'one\n', 'two\n', '> not this\n',
+            '### Section\n', '> nor this\n',
+            '##### Requirement 1.2\n', '> This one.\n',
+        ]
+        self.assertEqual([('#####', ' Requirement 1.2', '> This one.\n')], list(tokenize(content)))
+
+    def test_matches_the_test_specification(self):
+        with open(join(dirname(abspath(__file__)), 'test_specification.md')) as f:
+            ids = [headline.strip() for _, headline, _ in tokenize(f)]
+        self.assertEqual(['Requirement Some requirement', 'Requirement Some other requirement',
+                          'Requirement Another requirement-name', 'Condition 1',
+                          'Requirement This is the name of-the-requirement', 'Condition 2'], ids)
+
+
+class TestHeadlineTree(TestCase):
+    def test_unwinds_several_levels_at_once(self):
+        root, diagnostics = build_headline_tree([
+            ('####', ' Condition 1.1', '> a'),
+            ('#####', ' Condition 1.1.1', '> b'),
+            ('######', ' Conditional Requirement 1.1.1.1', '> c **MUST**'),
+            ('####', ' Requirement 1.2', '> d **MUST**'),
+        ])
+        self.assertEqual([' Condition 1.1', ' Requirement 1.2'], [n.headline for n in root.children])
+        self.assertEqual([], root.children[1].children)
+        self.assertEqual([], diagnostics)
+
+    def test_reports_skipped_levels_and_orphans(self):
+        diagnostics = []
+        rules = parsed_content_to_hierarchy([
+            ('####', ' Requirement 1.1', '> a **MUST**'),
+            ('######', ' Conditional Requirement 1.1.1', '> b **MUST**'),
+        ], diagnostics)
+        self.assertEqual('Conditional Requirement 1.1.1', rules[0].children[0].id)
+        self.assertEqual(['skipped-level', 'orphan-conditional-requirement'], [d.kind for d in diagnostics])
+        self.assertEqual(' Conditional Requirement 1.1.1', diagnostics[0].headline)
+
+    def test_parse_attaches_the_file_to_diagnostics(self):
+        with TemporaryDirectory() as root:
+            path = join(root, 'spec.md')
+            with open(path, 'w') as f:
+                f.write('#### Conditional Requirement 1.1.1\n\n> It **MUST** work.\n')
+            diagnostics = []
+            parse(path, diagnostics)
+            self.assertEqual([Diagnostic('orphan-conditional-requirement', ' Conditional Requirement 1.1.1',
+                                         'is not nested below a condition', path)], diagnostics)
+
+
+class TestRequirementNode(TestCase):
+    def test_to_json_matches_the_specification_schema(self):
+        node = gen_node({'headline': ' Requirement 4.2', 'content': '> You **MUST** be joking'})
+        self.assertEqual({
+            'id': 'Requirement 4.2',
+            'machine_id': 'requirement_4_2',
+            'content': 'You MUST be joking',
+            'RFC 2119 keyword': 'MUST',
+            'children': [],
+        }, node.to_json())
+        self.assertEqual(node, RequirementNode.from_json(node.to_json()))
+
+    def test_tree_conversion_flattens_non_requirement_headlines(self):
+        root, _ = build_headline_tree([
+            ('####', ' Notes', '> not a requirement'),
+            ('#####', ' Requirement 1.1', '> a **MUST**'),
+            ('#####', ' Condition 1.2', '> b'),
+            ('######', ' Extra notes', '> not one either'),
+            ('#######', ' Conditional Requirement 1.2.1', '> c **MAY**'),
+        ])
+        rules = content_tree_to_spec(root)
+        self.assertEqual(['Requirement 1.1', 'Condition 1.2'], [r.id for r in rules])
+        self.assertEqual(['Conditional Requirement 1.2.1'], [r.id for r in rules[1].children])
+        self.assertIsNone(content_tree_to_spec(build_headline_tree([('####', ' Notes', '> text')])[0]))
+
+
+class TestTimings(TestCase):
+    def test_timings_record_phases_and_parsed_files(self):
+        path = join(dirname(abspath(__file__)), 'test_specification.md')
+        with TemporaryDirectory() as tmp:
+            timings_path = join(tmp, 'timings.json')
+            with redirect_stderr(StringIO()) as stderr, instrumented(timings_path):
+                with phase('parse'):
+                    parse(path)
+            parse(path)
+            with open(timings_path) as f:
+                timings = json.load(f)
+
+        self.assertEqual(['parse'], list(timings['phases']))
+        [parsed] = timings['files']
+        self.assertEqual(path, parsed['path'])
+        self.assertEqual(len(open(path, 'rb').read()), parsed['bytes_read'])
+        self.assertEqual(len(list(tokenize(open(path)))), parsed['matches'])
+        self.assertIn('1 files parsed', stderr.getvalue())
+
+
+class TestSpecIgnore(TestCase):
+    def test_gitignore_semantics(self):
+        spec_ignore = SpecIgnore(['**/README.md', 'tools', 'build/', '/docs/*.md', '!docs/keep.md', 'draft?.md'])
+        self.assertTrue(spec_ignore.ignores('README.md'))
+        self.assertTrue(spec_ignore.ignores('a/b/README.md'))
+        self.assertTrue(spec_ignore.ignores('tools', is_dir=True))
+        self.assertTrue(spec_ignore.ignores('a/tools', is_dir=True))
+        self.assertTrue(spec_ignore.ignores('build', is_dir=True))
+        self.assertFalse(spec_ignore.ignores('build'))
+        self.assertTrue(spec_ignore.ignores('docs/intro.md'))
+        self.assertFalse(spec_ignore.ignores('docs/keep.md'))
+        self.assertFalse(spec_ignore.ignores('docs/deeper/intro.md'))
+        self.assertFalse(spec_ignore.ignores('a/docs/intro.md'))
+        self.assertTrue(spec_ignore.ignores('a/draft1.md'))
+        self.assertFalse(spec_ignore.ignores('a/draft10.md'))
+
+    def test_find_markdown_file_paths_is_relative_to_root(self):
+        with TemporaryDirectory() as root:
+            for path in ['spec.md', 'README.md', 'sections/a.md', 'sections/README.md',
+                         'node_modules/pkg/b.md', 'notes.txt']:
+                makedirs(dirname(join(root, path)), exist_ok=True)
+                open(join(root, path), 'w').close()
+            with open(join(root, '.specignore'), 'w') as f:
+                f.write('# comment\n\n**/README.md\nnode_modules/\n')
+
+            cwd = getcwd()
+            chdir(dirname(abspath(__file__)))
+            try:
+                found = find_markdown_file_paths(root)
+            finally:
+                chdir(cwd)
+            self.assertEqual([join(root, 'sections', 'a.md'), join(root, 'spec.md')], found)
+
+
+class TestJsonOutput(TestCase):
+    rules = [
+        RequirementNode('Requirement 1.1', 'requirement_1_1', 'MUST', 'It "MUST" work.\nReally.'),
+        RequirementNode('Condition 1.2', 'condition_1_2', None, 'If so', [
+            RequirementNode('Conditional Requirement 1.2.1', 'conditional_requirement_1_2_1', 'MAY', 'Then é'),
+        ]),
+    ]
+
+    def test_streamed_output_matches_json_dumps(self):
+        for rules in (self.rules, []):
+            as_json = [rule.to_json() for rule in rules]
+            self.assertEqual(json.dumps({'rules': as_json}, indent=4), ''.join(iter_json_rules(rules)))
+            self.assertEqual(json.dumps(as_json, indent=4), ''.join(iter_json_rules(rules, key=None)))
+            self.assertEqual(json.dumps({'rules': as_json}, separators=(',', ':')),
+                             ''.join(iter_json_rules(rules, 'compact')))
+            self.assertEqual(json.dumps(as_json, separators=(',', ':')),
+                             ''.join(iter_json_rules(rules, 'compact', key=None)))
+
+    def test_json_lines(self):
+        lines = ''.join(iter_json_rules(self.rules, 'jsonl')).splitlines()
+        self.assertEqual([rule.to_json() for rule in self.rules], [json.loads(line) for line in lines])
+
+    def test_write_specification_replaces_the_file_atomically(self):
+        with TemporaryDirectory() as root:
+            path = join(root, 'specification.json')
+            write_specification(path, self.rules)
+            with open(path) as f:
+                self.assertEqual([rule.to_json() for rule in self.rules], json.load(f)['rules'])
+
+            broken = RequirementNode('Requirement 2.1', 'requirement_2_1', 'MUST', object())
+            with self.assertRaises(TypeError):
+                write_specification(path, self.rules + [broken])
+            self.assertEqual(['specification.json'], listdir(root))
+            with open(path) as f:
+                self.assertEqual(2, len(json.load(f)['rules']))
+
+
+class TestSpecWatcher(TestCase):
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_only_changed_files_are_reparsed(self):
+        with TemporaryDirectory() as root:
+            first, second = join(root, 'a.md'), join(root, 'b.md')
+            self.write(first, '#### Requirement 1.10\n\n> It **MUST** work.\n')
+            self.write(second, '#### Requirement 1.9\n\n> It **MAY** work.\n')
+            watcher = SpecWatcher(root)
+
+            self.assertEqual([first, second], watcher.poll())
+            self.assertEqual(['Requirement 1.9', 'Requirement 1.10'], [r.id for r in watcher.rules()])
+            self.assertEqual([], watcher.poll())
+
+            self.write(first, '#### Requirement 1.10\n\n> It **SHOULD** work, eventually.\n')
+            self.assertEqual([first], watcher.poll())
+            self.assertEqual('SHOULD', watcher.rules()[1].keyword)
+
+            remove(second)
+            self.assertEqual([second], watcher.poll())
+            self.assertEqual(['Requirement 1.10'], [r.id for r in watcher.rules()])
+
+    def test_errors_do_not_end_the_watch(self):
+        with TemporaryDirectory() as root:
+            source, output = join(root, 'a.md'), join(root, 'specification.json')
+            saves = ['#### Requirement 1.\n\n> It **MUST** work.\n', '#### Requirement 1.1\n\n> It **MUST** work.\n']
+
+            def save_next(interval):
+                if not saves:
+                    raise KeyboardInterrupt
+                self.write(source, saves.pop(0))
+
+            self.write(source, '#### Requirement 1.2\n\n> It **MUST** work.\n')
+            with patch('specification_parser.sleep', save_next), redirect_stderr(StringIO()) as stderr:
+                with self.assertRaises(KeyboardInterrupt):
+                    watch(root, output, interval=0)
+            self.assertIn(f'Could not update {output}: ValueError', stderr.getvalue())
+            with open(output) as f:
+                self.assertEqual(['Requirement 1.1'], [rule['id'] for rule in json.load(f)['rules']])
+
+    def test_unparsable_files_keep_their_rules(self):
+        with TemporaryDirectory() as root:
+            source = join(root, 'a.md')
+            self.write(source, '#### Requirement 1.1\n\n> It **MUST** work.\n')
+            watcher = SpecWatcher(root)
+            watcher.poll()
+
+            self.write(source, '#### Requirement 1.1\n\n> It **MUST** work, mostly.\n')
+            with patch('specification_parser.parse', side_effect=UnicodeDecodeError('utf-8', b'', 0, 1, 'bad')):
+                self.assertEqual([source], watcher.poll())
+            self.assertEqual(["a.md: UnicodeDecodeError('utf-8', b'', 0, 1, 'bad')"], watcher.errors)
+            self.assertEqual(['Requirement 1.1'], [r.id for r in watcher.rules()])
+            self.assertEqual([], watcher.poll())
+            self.assertEqual([], watcher.errors)
+
+
+class TestLint(TestCase):
+    def rule(self, rule_id, keyword='MUST', children=()):
+        return {
+            'id': rule_id,
+            'machine_id': re.sub(r'[^\w]', '_', rule_id.lower()),
+            'content': f'It {keyword} work.' if keyword else 'If so.',
+            'RFC 2119 keyword': keyword,
+            'children': list(children),
+        }
+
+    def test_clean_specification(self):
+        spec = {'rules': [
+            self.rule('Requirement 1.1.1'),
+            self.rule('Condition 1.1.2', None, [self.rule('Conditional Requirement 1.1.2.1', 'MAY')]),
+            self.rule('Requirement 1.2.1.1'),
+            self.rule('Requirement 2.1.1'),
+        ]}
+        self.assertEqual([], run_checks(spec))
+
+    def test_checks_every_depth(self):
+        conflicting = dict(self.rule('Requirement 1.1.4'), content='It SHOULD work.')
+        spec = {'rules': [
+            self.rule('Requirement 1.1.1'),
+            self.rule('Condition 1.1.2', None, [
+                self.rule('Conditional Requirement 1.1.2.1', None),
+                self.rule('Conditional Requirement 1.1.1', 'MAY'),
+            ]),
+            conflicting,
+        ]}
+        found = {(d.check, d.severity, d.rule) for d in run_checks(spec)}
+        self.assertEqual({
+            ('missing-keyword', 'error', 'Conditional Requirement 1.1.2.1'),
+            ('conflicting-keyword', 'error', 'Requirement 1.1.4'),
+            ('numbering-gap', 'warning', '1.1'),
+            ('parent-number-mismatch', 'warning', 'Conditional Requirement 1.1.1'),
+        }, found)
+
+        spec['rules'].append(self.rule('Requirement 1.1.4'))
+        self.assertEqual([('error', 'Requirement 1.1.4')], [(d.severity, d.rule) for d in run_checks(spec, ['duplicate-id'])])
+        spec['rules'][-1]['machine_id'] = 'requirement_1_1_4_again'
+        self.assertEqual(['Requirement 1.1.4'], [d.rule for d in run_checks(spec, ['duplicate-id'])])
+        self.assertEqual(['parent-number-mismatch'], [d.check for d in run_checks(spec, ['parent-number-mismatch'])])